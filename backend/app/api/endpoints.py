@@ -1,7 +1,9 @@
 import os
 import re
 import tempfile
+from typing import Optional
 
+from app.core.admission import AdmissionRejectedError
 from app.core.auth import verify_api_key
 from app.core.config import (
     ALLOWED_FILE_TYPES,
@@ -14,14 +16,17 @@ from app.core.config import (
 )
 from app.core.constants import error_logger, info_logger
 from app.core.ingestion import ingest_pdf
+from app.core.metrics import metrics
 from app.core.retrieval import retrieve_answer
 from app.core.validation import (
     FileValidationError,
     check_rate_limit,
+    refund_rate_limit,
     validate_file_content,
     validate_file_headers,
 )
 from fastapi import APIRouter, Depends, Form, Header, HTTPException, Request, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, EmailStr, Field
 
 router = APIRouter()
@@ -31,6 +36,13 @@ router = APIRouter()
 class QueryRequest(BaseModel):
     query: str = Field(..., min_length=1, max_length=500)
     user_email: EmailStr = Field(..., description="Valid email address")
+    session_id: Optional[str] = Field(
+        None,
+        min_length=1,
+        max_length=64,
+        pattern=r"^[A-Za-z0-9_-]+$",
+        description="Conversation id, the answer takes the earlier questions of the session into account",
+    )
 
 
 # Read root
@@ -39,6 +51,12 @@ def read_root():
     return {"message": "Hello, World!"}
 
 
+# Read the in-process metrics
+@router.get("/metrics")
+def read_metrics(api_key: str = Depends(verify_api_key)):
+    return metrics.snapshot()
+
+
 # Ingest the file into the database
 @router.post("/ingest")
 async def ingest_file(
@@ -80,14 +98,20 @@ async def ingest_file(
 
         # Process the file
         if file.content_type == "application/pdf":
-            metadata = ingest_pdf(temp_file_path, user_email)
+            # run in the threadpool so waiting for upstream slots doesn't block the event loop
+            metadata = await run_in_threadpool(
+                ingest_pdf, temp_file_path, user_email, file.filename
+            )
 
             # Log successful ingestion
             info_logger.info(
                 f"File ingested successfully: {file.filename}, "
                 f"size: {metadata['size']}, "
                 f"pages: {metadata['pages']}, "
-                f"chunks: {metadata['chunks']}"
+                f"chunks: {metadata['chunks']}, "
+                f"version: {metadata['version']}, "
+                f"chunks added: {metadata['chunks_added']}, "
+                f"chunks deleted: {metadata['chunks_deleted']}"
             )
 
             return {
@@ -103,6 +127,16 @@ async def ingest_file(
         error_logger.error(f"File validation error: {e}")
         raise HTTPException(status_code=e.status_code, detail=e.message)
 
+    except AdmissionRejectedError as e:
+        # Log rejected ingestions, they don't count against the user's rate limit
+        error_logger.error(f"Ingestion rejected: {e}")
+        refund_rate_limit(user_email, "ingest")
+        raise HTTPException(
+            status_code=503,
+            detail=e.message,
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
     except Exception as e:
         # Log unexpected errors
         error_logger.error(f"Unexpected error: {e}")
@@ -133,11 +167,23 @@ async def ask_question(request: QueryRequest, api_key: str = Depends(verify_api_
         # Log the query
         info_logger.info(f"Processing query: {request.query}")
 
-        # Get answer from LLM
-        answer = retrieve_answer(request.query, request.user_email)
+        # Get answer from LLM, in the threadpool so waiting for upstream slots doesn't block the event loop
+        answer = await run_in_threadpool(
+            retrieve_answer, request.query, request.user_email, request.session_id
+        )
 
         return {"status": "success", "query": request.query, "answer": answer}
 
+    except AdmissionRejectedError as e:
+        # rejected queries don't count against the user's rate limit
+        error_logger.error(f"Query rejected: {e}")
+        refund_rate_limit(request.user_email, "ask")
+        raise HTTPException(
+            status_code=503,
+            detail=e.message,
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
     except Exception as e:
         error_logger.error(f"Error processing query: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
@@ -0,0 +1,146 @@
+# Admission control for the upstream services (LLM, embeddings & vector db)
+# every upstream call takes a slot of its upstream, callers that can't get a
+# slot wait in a bounded priority queue (interactive asks ahead of ingestion),
+# when the queue is full or the wait takes too long the call is rejected so the
+# api can answer 503 with a Retry-After instead of piling up on the provider
+import heapq
+import itertools
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+from app.core.config import ADMISSION_LIMITS
+from app.core.metrics import metrics
+
+# priorities, lower values are served first
+INTERACTIVE = 0
+BACKGROUND = 1
+
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+
+# Custom exception for calls rejected by the admission control
+class AdmissionRejectedError(Exception):
+    """Custom exception for calls rejected by the admission control"""
+
+    def __init__(self, message: str, retry_after: int):
+        self.message = message
+        self.retry_after = retry_after
+        super().__init__(self.message)
+
+
+class UpstreamLimiter:
+    """Concurrency slots of one upstream with a bounded priority wait queue"""
+
+    def __init__(self, name: str, slots: int, max_queue: int, max_wait_seconds: float):
+        self.name = name
+        self.slots = slots
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self._in_use = 0
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        # moving average of how long a slot is held, used for Retry-After
+        self._average_hold_seconds = 1.0
+
+    # seconds a rejected caller should wait before retrying
+    def _retry_after(self) -> int:
+        backlog = len(self._waiters) + 1
+        return max(1, math.ceil(backlog * self._average_hold_seconds / self.slots))
+
+    def _report(self) -> None:
+        metrics.set_gauge("admission_queue_depth", len(self._waiters), upstream=self.name)
+        metrics.set_gauge("admission_slots_in_use", self._in_use, upstream=self.name)
+
+    def _reject(self, priority: int, reason: str) -> AdmissionRejectedError:
+        metrics.increment(
+            "admission_rejected", upstream=self.name, priority=PRIORITY_NAMES[priority]
+        )
+        return AdmissionRejectedError(
+            f"Service is busy ({self.name} {reason}), please retry later",
+            self._retry_after(),
+        )
+
+    def acquire(self, priority: int = INTERACTIVE) -> None:
+        start = time.monotonic()
+        with self._condition:
+            if self._in_use < self.slots and not self._waiters:
+                self._in_use += 1
+            else:
+                if len(self._waiters) >= self.max_queue:
+                    raise self._reject(priority, "queue is full")
+
+                waiter = (priority, next(self._sequence))
+                heapq.heappush(self._waiters, waiter)
+                self._report()
+                deadline = start + self.max_wait_seconds
+
+                # wait until we are first in the queue and a slot is free
+                while not (self._waiters[0] == waiter and self._in_use < self.slots):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._waiters.remove(waiter)
+                        heapq.heapify(self._waiters)
+                        self._report()
+                        # the next waiter may be able to go now
+                        self._condition.notify_all()
+                        raise self._reject(priority, "wait timed out")
+                    self._condition.wait(remaining)
+
+                heapq.heappop(self._waiters)
+                self._in_use += 1
+                # let the next waiter check if a slot is still free
+                self._condition.notify_all()
+            self._report()
+
+        metrics.observe(
+            "admission_wait_seconds",
+            time.monotonic() - start,
+            upstream=self.name,
+            priority=PRIORITY_NAMES[priority],
+        )
+
+    # take a slot only if one is free right away, for optional calls like hedges
+    def try_acquire(self) -> bool:
+        with self._condition:
+            if self._in_use >= self.slots or self._waiters:
+                return False
+            self._in_use += 1
+            self._report()
+            return True
+
+    def release(self, held_seconds: float) -> None:
+        with self._condition:
+            self._in_use -= 1
+            self._average_hold_seconds = 0.9 * self._average_hold_seconds + 0.1 * held_seconds
+            self._report()
+            self._condition.notify_all()
+
+    @contextmanager
+    def slot(self, priority: int = INTERACTIVE):
+        self.acquire(priority)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+
+class AdmissionController:
+    """Limiters of all the upstream services"""
+
+    def __init__(self, limits: Dict[str, Dict[str, float]]):
+        self.limiters = {
+            name: UpstreamLimiter(name, **upstream_limits) for name, upstream_limits in limits.items()
+        }
+
+    # hold a slot of the upstream for the duration of the block
+    def slot(self, upstream: str, priority: int = INTERACTIVE):
+        return self.limiters[upstream].slot(priority)
+
+
+# admission controller shared by the whole process
+admission = AdmissionController(ADMISSION_LIMITS)
@@ -0,0 +1,225 @@
+# Fast path for the AstraDB vector db, built on astrapy's async database
+# - collection existence is answered from an in-process cache, misses are
+#   checked with a direct lookup on the collection instead of listing the keyspace
+# - inserts go through insert_many with a tuned chunk size & concurrency
+# - searches send the query vectors themselves (no server side vectorize) and
+#   several queries can be searched concurrently
+# the coroutines run on a dedicated event loop thread, so the sync code of the
+# app can call them from any thread, the thread & the client are only created on
+# the first call, so qdrant deployments never start them
+import asyncio
+import os
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+from app.core.config import (
+    ASTRA_DELETE_CHUNK_SIZE,
+    ASTRA_INSERT_CHUNK_SIZE,
+    ASTRA_INSERT_CONCURRENCY,
+    EMBEDDING_DIMENSIONS,
+)
+from astrapy import AsyncCollection, AsyncDatabase, DataAPIClient
+from astrapy.constants import VectorMetric
+from astrapy.exceptions import CollectionInsertManyException, DataAPIResponseException
+from astrapy.info import CollectionDefinition
+from langchain_core.documents import Document
+
+# fields of the documents, the same as written by AstraDBVectorStore
+CONTENT_FIELD = "content"
+METADATA_FIELD = "metadata"
+VECTOR_FIELD = "$vector"
+SIMILARITY_FIELD = "$similarity"
+
+COLLECTION_NOT_EXIST = "COLLECTION_NOT_EXIST"
+
+# event loop running all the astradb coroutines
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+# async astradb keyspace
+_async_keyspace: Optional[AsyncDatabase] = None
+
+# names of the collections known to exist, collections are never dropped by the app
+_known_collections: Set[str] = set()
+
+# collection handles by name, every new handle builds its own http client
+_collections: Dict[str, AsyncCollection] = {}
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="astradb", daemon=True).start()
+        return _loop
+
+
+# run the coroutine on the astradb event loop & wait for its result
+def _run(coroutine, timeout: Optional[float] = None) -> Any:
+    return asyncio.run_coroutine_threadsafe(coroutine, _get_loop()).result(timeout)
+
+
+# only called on the event loop thread, so no locking is needed,
+# the settings are read on first use, after the .env was loaded
+def _get_keyspace() -> AsyncDatabase:
+    global _async_keyspace
+    if _async_keyspace is None:
+        _async_keyspace = DataAPIClient(
+            environment=os.getenv("ASTRA_DB_ENVIRONMENT", "prod"),
+        ).get_async_database(
+            api_endpoint=os.getenv("ASTRA_DB_API_ENDPOINT"),
+            token=os.getenv("ASTRA_DB_APPLICATION_TOKEN"),
+            keyspace=os.getenv("ASTRA_DB_KEYSPACE"),
+        )
+    return _async_keyspace
+
+
+# only called on the event loop thread, so no locking is needed
+def _get_collection(collection_name: str) -> AsyncCollection:
+    if collection_name not in _collections:
+        _collections[collection_name] = _get_keyspace().get_collection(collection_name)
+    return _collections[collection_name]
+
+
+async def _collection_exists(collection_name: str) -> bool:
+    if collection_name in _known_collections:
+        return True
+    try:
+        # a single request on the collection itself, independent of the number of collections
+        await _get_collection(collection_name).estimated_document_count()
+    except DataAPIResponseException as e:
+        if any(d.error_code == COLLECTION_NOT_EXIST for d in e.error_descriptors):
+            return False
+        raise
+    _known_collections.add(collection_name)
+    return True
+
+
+async def _create_collection(collection_name: str) -> None:
+    _collections[collection_name] = await _get_keyspace().create_collection(
+        collection_name,
+        definition=CollectionDefinition.builder()
+        .set_vector_dimension(EMBEDDING_DIMENSIONS)
+        .set_vector_metric(VectorMetric.COSINE)
+        .build(),
+    )
+    _known_collections.add(collection_name)
+
+
+async def _add_documents(
+    collection_name: str,
+    documents: List[Document],
+    vectors: List[List[float]],
+    ids: Sequence[str],
+) -> None:
+    collection = _get_collection(collection_name)
+    rows = {
+        doc_id: {
+            "_id": doc_id,
+            CONTENT_FIELD: doc.page_content,
+            METADATA_FIELD: doc.metadata,
+            VECTOR_FIELD: vector,
+        }
+        for doc_id, doc, vector in zip(ids, documents, vectors)
+    }
+    try:
+        await collection.insert_many(
+            list(rows.values()),
+            ordered=False,
+            chunk_size=ASTRA_INSERT_CHUNK_SIZE,
+            concurrency=ASTRA_INSERT_CONCURRENCY,
+        )
+    except CollectionInsertManyException as e:
+        # ids that already exist (e.g. a retried ingestion) are overwritten instead
+        inserted = set(e.inserted_ids)
+        semaphore = asyncio.Semaphore(ASTRA_INSERT_CONCURRENCY)
+
+        async def replace(row: Dict[str, Any]) -> None:
+            async with semaphore:
+                await collection.replace_one({"_id": row["_id"]}, row, upsert=True)
+
+        await asyncio.gather(*(replace(row) for doc_id, row in rows.items() if doc_id not in inserted))
+
+
+async def _delete_documents(collection_name: str, ids: Sequence[str]) -> None:
+    collection = _get_collection(collection_name)
+    ids = list(ids)
+    semaphore = asyncio.Semaphore(ASTRA_INSERT_CONCURRENCY)
+
+    async def delete(batch: List[str]) -> None:
+        async with semaphore:
+            await collection.delete_many({"_id": {"$in": batch}})
+
+    # the data api accepts a limited number of values per $in
+    await asyncio.gather(
+        *(delete(ids[i : i + ASTRA_DELETE_CHUNK_SIZE]) for i in range(0, len(ids), ASTRA_DELETE_CHUNK_SIZE))
+    )
+
+
+async def _search(
+    collection_name: str, vector: List[float], k: int
+) -> List[Tuple[Document, float]]:
+    cursor = _get_collection(collection_name).find(
+        {},
+        sort={VECTOR_FIELD: vector},
+        limit=k,
+        include_similarity=True,
+        projection={CONTENT_FIELD: True, METADATA_FIELD: True},
+    )
+    return [
+        (
+            Document(
+                id=str(row["_id"]),
+                page_content=row.get(CONTENT_FIELD, ""),
+                metadata=row.get(METADATA_FIELD) or {},
+            ),
+            row[SIMILARITY_FIELD],
+        )
+        for row in await cursor.to_list()
+    ]
+
+
+async def _batch_search(
+    collection_name: str, vectors: List[List[float]], k: int
+) -> List[List[Tuple[Document, float]]]:
+    return list(await asyncio.gather(*(_search(collection_name, vector, k) for vector in vectors)))
+
+
+# check if the collection exists
+def collection_exists(collection_name: str) -> bool:
+    return _run(_collection_exists(collection_name))
+
+
+# create the vector collection
+def create_collection(collection_name: str) -> None:
+    _run(_create_collection(collection_name))
+
+
+# insert the already embedded documents
+def add_documents(
+    collection_name: str,
+    documents: List[Document],
+    vectors: List[List[float]],
+    ids: Sequence[str],
+) -> None:
+    _run(_add_documents(collection_name, documents, vectors, ids))
+
+
+# delete the documents of the given ids in bulk
+def delete_documents(collection_name: str, ids: Sequence[str]) -> None:
+    _run(_delete_documents(collection_name, ids))
+
+
+# search the collection with an already embedded query
+def similarity_search_with_score_by_vector(
+    collection_name: str, vector: List[float], k: int = 5
+) -> List[Tuple[Document, float]]:
+    return _run(_search(collection_name, vector, k))
+
+
+# search the collection with several embedded queries concurrently
+def batch_similarity_search_with_score_by_vector(
+    collection_name: str, vectors: List[List[float]], k: int = 5
+) -> List[List[Tuple[Document, float]]]:
+    return _run(_batch_search(collection_name, vectors, k))
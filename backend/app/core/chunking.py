@@ -0,0 +1,134 @@
+# Token aware chunking of the pages loaded by PyPDF
+# chunks never cross a page and are built out of whole sentences where possible
+# steps:
+# 1. detect the document type from its page layout & pick the chunk profile
+# 2. split every page into sentences (and paragraphs) & tokenize each sentence once
+# 3. split the rare sentences larger than a chunk into token windows
+# 4. greedily pack the sentences of a page into chunks of at most chunk_tokens,
+#    carrying the trailing pieces (up to overlap_tokens) over into the next chunk
+import re
+from typing import List, Optional, Tuple
+
+from app.core.config import CHUNKING_PROFILES, EMBEDDING_MODEL
+from app.core.tokens import get_encoding
+from langchain_core.documents import Document
+
+# paragraph breaks & sentence ends, captured so the original whitespace is kept
+PIECE_SEPARATOR = re.compile(r"(\n\s*\n|(?<=[.!?])\s+)")
+
+# a line looks tabular if it has several numbers or several column gaps
+NUMBER = re.compile(r"\d[\d,.%]*")
+COLUMN_GAP = re.compile(r"\S(?:\t| {3,})(?=\S)")
+TABULAR_MIN_NUMBERS = 3
+TABULAR_MIN_COLUMN_GAPS = 2
+
+# number of lines sampled to detect tabular documents
+DETECTION_SAMPLE_LINES = 2000
+
+# pages with fewer characters than this on average are treated as slides
+SLIDES_MAX_PAGE_CHARS = 600
+
+# documents with at least this fraction of tabular lines are treated as tables
+TABULAR_MIN_LINE_RATIO = 0.35
+
+# a piece of a page: (text, token count, separator placed before it)
+Piece = Tuple[str, int, str]
+
+
+# detect the type of the document from the layout of its pages
+def detect_document_type(docs: List[Document]) -> str:
+    pages = [doc.page_content for doc in docs if doc.page_content.strip()]
+    if not pages:
+        return "default"
+
+    if sum(len(page) for page in pages) / len(pages) < SLIDES_MAX_PAGE_CHARS:
+        return "slides"
+
+    lines = [line for page in pages for line in page.splitlines() if line.strip()]
+    lines = lines[:DETECTION_SAMPLE_LINES]
+    tabular_lines = sum(
+        1
+        for line in lines
+        if len(NUMBER.findall(line)) >= TABULAR_MIN_NUMBERS
+        or len(COLUMN_GAP.findall(line)) >= TABULAR_MIN_COLUMN_GAPS
+    )
+    if tabular_lines / len(lines) >= TABULAR_MIN_LINE_RATIO:
+        return "tabular"
+
+    return "prose"
+
+
+# split the pages into token bounded chunks
+def split_documents(
+    docs: List[Document],
+    chunk_tokens: Optional[int] = None,
+    overlap_tokens: Optional[int] = None,
+    document_type: Optional[str] = None,
+) -> List[Document]:
+    profile = CHUNKING_PROFILES[document_type or detect_document_type(docs)]
+    chunk_tokens = chunk_tokens or profile["chunk_tokens"]
+    overlap_tokens = profile["overlap_tokens"] if overlap_tokens is None else overlap_tokens
+    encoding = get_encoding(EMBEDDING_MODEL)
+
+    chunks = []
+    for doc in docs:
+        # texts & the separators between them alternate
+        parts = PIECE_SEPARATOR.split(doc.page_content.strip())
+        pieces = []
+        for i in range(0, len(parts), 2):
+            if parts[i]:
+                separator = parts[i - 1] if i else ""
+                pieces.extend(_split_sentence(parts[i], separator, chunk_tokens, encoding))
+
+        for text in _pack(pieces, chunk_tokens, overlap_tokens):
+            chunks.append(Document(page_content=text, metadata=dict(doc.metadata)))
+
+    return chunks
+
+
+# tokenize a sentence, splitting it into token windows if it doesn't fit into a chunk
+def _split_sentence(sentence: str, separator: str, chunk_tokens: int, encoding) -> List[Piece]:
+    tokens = encoding.encode_ordinary(sentence)
+    if len(tokens) <= chunk_tokens:
+        return [(sentence, len(tokens), separator)]
+    # no sentence boundary to split on, fall back to fixed token windows
+    pieces = []
+    for start in range(0, len(tokens), chunk_tokens):
+        window = tokens[start : start + chunk_tokens]
+        pieces.append((encoding.decode(window), len(window), separator if start == 0 else " "))
+    return pieces
+
+
+# greedily pack the pieces of a page into chunks with overlap
+def _pack(pieces: List[Piece], chunk_tokens: int, overlap_tokens: int) -> List[str]:
+    chunks = []
+    current, size = [], 0
+    for piece in pieces:
+        # every separator is counted as one token
+        if current and size + piece[1] + 1 > chunk_tokens:
+            chunks.append(_join(current))
+
+            # carry the trailing pieces over into the next chunk
+            carried, carried_size = [], 0
+            for previous in reversed(current):
+                if carried_size + previous[1] + 1 > overlap_tokens:
+                    break
+                carried.insert(0, previous)
+                carried_size += previous[1] + 1
+
+            # drop the overlap if the next piece doesn't fit next to it
+            while carried and carried_size + piece[1] + 1 > chunk_tokens:
+                carried_size -= carried.pop(0)[1] + 1
+            current, size = carried, carried_size
+
+        current.append(piece)
+        size += piece[1] + 1
+
+    if current:
+        chunks.append(_join(current))
+    return chunks
+
+
+# join the pieces of a chunk with their separators
+def _join(pieces: List[Piece]) -> str:
+    return pieces[0][0] + "".join(separator + text for text, _, separator in pieces[1:])
@@ -27,3 +27,105 @@ RATE_LIMIT_MAX_REQUESTS_INGESTION_API = 5
 RATE_LIMIT_WINDOW_SECONDS_INGESTION_API = 86400
 RATE_LIMIT_MAX_REQUESTS_ASK_API = 20
 RATE_LIMIT_WINDOW_SECONDS_ASK_API = 86400
+
+# LLM Configuration
+LLM_MODEL = "gpt-4.1"
+
+# Model Routing Configuration
+# every query is answered by one of these model tiers, picked by the router
+MODEL_TIERS = {
+    "large": LLM_MODEL,
+    "small": "gpt-4.1-mini",
+    "tiny": "gpt-4.1-nano",
+}
+# the top document must beat the similarity threshold by this margin to use the small tier
+ROUTER_CONFIDENT_MARGIN = 0.10
+# maximum context tokens for a query to be answered by the small tier
+ROUTER_SMALL_TIER_MAX_CONTEXT_TOKENS = 800
+# large tier calls in flight after which new queries are downgraded to the small tier
+ROUTER_MAX_INFLIGHT_LARGE = 8
+
+# Retrieval Configuration
+# tuned offline with benchmarks/retrieval_sweep.py
+# number of chunks retrieved per query
+RETRIEVAL_K = 5
+# similarity threshold for considering a document relevant
+SIMILARITY_THRESHOLD = 0.60
+# size of the qdrant hnsw candidate list per search, None for the collection default
+RETRIEVAL_HNSW_EF = None
+
+# Prompt Configuration
+# maximum number of tokens of retrieved context sent to the LLM
+PROMPT_CONTEXT_TOKEN_BUDGET = 2000
+# a document cut by the budget is dropped if fewer tokens than this are left
+PROMPT_MIN_DOCUMENT_TOKENS = 50
+
+# Conversation Memory Configuration
+# every session keeps its last turns verbatim, older turns are folded into a rolling summary
+CONVERSATION_RECENT_TURNS = 4
+# a stored turn (question & answer) is cut to this many tokens
+CONVERSATION_TURN_MAX_TOKENS = 250
+# maximum tokens of the rolling summary
+CONVERSATION_SUMMARY_MAX_TOKENS = 300
+# maximum tokens of history (summary & recent turns) sent with a question
+CONVERSATION_HISTORY_TOKEN_BUDGET = 1300
+# sessions expire after this many seconds without a question
+CONVERSATION_TTL_SECONDS = 86400
+
+# Embedding Configuration
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIMENSIONS = 1536
+
+# Matryoshka (truncated embeddings) Configuration
+# the first stage searches the truncated vectors, the top candidates are then
+# rescored against the full vectors
+MATRYOSHKA_DIMENSIONS = 256
+MATRYOSHKA_CANDIDATES = 50
+MATRYOSHKA_VECTOR_NAME = "mrl"
+FULL_VECTOR_NAME = "full"
+
+# Chunking Configuration (sizes are in embedding model tokens)
+# chunk size & overlap are picked per document based on its detected type
+CHUNKING_PROFILES = {
+    "prose": {"chunk_tokens": 350, "overlap_tokens": 35},
+    "slides": {"chunk_tokens": 200, "overlap_tokens": 0},
+    "tabular": {"chunk_tokens": 300, "overlap_tokens": 0},
+    "default": {"chunk_tokens": 300, "overlap_tokens": 30},
+}
+
+# Admission Control Configuration
+# concurrent calls allowed per upstream, callers beyond that wait in a bounded
+# priority queue and are rejected with a 503 when it is full or the wait is too long
+ADMISSION_LIMITS = {
+    "llm": {"slots": 16, "max_queue": 64, "max_wait_seconds": 10},
+    "embeddings": {"slots": 16, "max_queue": 64, "max_wait_seconds": 10},
+    "vectordb": {"slots": 32, "max_queue": 128, "max_wait_seconds": 5},
+}
+
+# Resilience Configuration
+# latency budget of a whole /ask request, every upstream call gets what is left of it
+REQUEST_BUDGET_SECONDS = 30
+# maximum duration of a single call per upstream
+UPSTREAM_TIMEOUTS = {
+    "embeddings": 5,
+    "vectordb": 3,
+    "llm": 25,
+    "redis": 1,
+}
+# idempotent calls are hedged once they take longer than this percentile of recent calls
+HEDGE_PERCENTILE = 95
+HEDGE_MIN_SAMPLES = 20
+# consecutive failures that open a circuit & how long it stays open
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = 5
+CIRCUIT_BREAKER_RESET_SECONDS = 30
+
+# Collection Export/Import Configuration
+TRANSFER_BATCH_SIZE = 256
+TRANSFER_WORKERS = 8
+
+# AstraDB Configuration
+# documents per insertMany request (the data api accepts at most 100) & requests in flight
+ASTRA_INSERT_CHUNK_SIZE = 100
+ASTRA_INSERT_CONCURRENCY = 16
+# ids per deleteMany request
+ASTRA_DELETE_CHUNK_SIZE = 100
@@ -9,10 +9,20 @@ from dotenv import load_dotenv
 from langchain_astradb import AstraDBVectorStore
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain_qdrant import QdrantVectorStore
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from qdrant_client import QdrantClient
+from qdrant_client import QdrantClient, models
 from astrapy import DataAPIClient
 
+from app.core import astradb
+from app.core.config import (
+    EMBEDDING_DIMENSIONS,
+    EMBEDDING_MODEL,
+    FULL_VECTOR_NAME,
+    MATRYOSHKA_DIMENSIONS,
+    MATRYOSHKA_VECTOR_NAME,
+    MODEL_TIERS,
+    UPSTREAM_TIMEOUTS,
+)
+
 # hash the user email using base64 encoding
 def md5_b64(s: str) -> str:
     d = hashlib.md5(s.encode("utf-8")).digest()
@@ -25,28 +35,36 @@ load_dotenv()
 error_logger = logging.getLogger("uvicorn.error")
 info_logger = logging.getLogger("uvicorn.info")
 
-# Initialize the text splitter
-text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-
 # Initialize the embeddings
 embeddings = OpenAIEmbeddings(
-    model="text-embedding-3-small",
+    model=EMBEDDING_MODEL,
+    request_timeout=UPSTREAM_TIMEOUTS["embeddings"],
+    max_retries=1,
 )
 
-# create LLM
-llm = ChatOpenAI(
-    model="gpt-4.1",
-)
+# create LLM for every model tier
+llms = {
+    tier: ChatOpenAI(
+        model=model,
+        timeout=UPSTREAM_TIMEOUTS["llm"],
+        max_retries=1,
+    )
+    for tier, model in MODEL_TIERS.items()
+}
 
 # create qrant client
 qdrant_client = QdrantClient(
     url=os.getenv("QDRANT_URL"),
+    timeout=UPSTREAM_TIMEOUTS["vectordb"],
 )
 
 # create astradb keyspace
-astradb_keyspace = DataAPIClient().get_database(
+astradb_keyspace = DataAPIClient(
+    environment=os.getenv("ASTRA_DB_ENVIRONMENT", "prod"),
+).get_database(
     api_endpoint=os.getenv("ASTRA_DB_API_ENDPOINT"),
     token=os.getenv("ASTRA_DB_APPLICATION_TOKEN"),
+    keyspace=os.getenv("ASTRA_DB_KEYSPACE"),
 )
 
 # create redis client
@@ -54,20 +72,21 @@ redis_client = redis.Redis(
     host=os.getenv("REDIS_HOST"),
     port=int(os.getenv("REDIS_PORT")),
     password=os.getenv("REDIS_PASSWORD"),
+    socket_timeout=UPSTREAM_TIMEOUTS["redis"],
+    socket_connect_timeout=UPSTREAM_TIMEOUTS["redis"],
 )
 
 # vector db to use
 vector_db = os.getenv("VECTOR_DB", "QDRANT")
 
+# index truncated (matryoshka) embeddings for the first stage search, only supported for qdrant
+matryoshka_embeddings = os.getenv("MATRYOSHKA_EMBEDDINGS", "false").lower() == "true"
+
 # check if collection exists in vector db
 def collection_exists(user_email: str):
     collection_name = md5_b64(user_email)
     if vector_db == "ASTRADB":
-        collections = astradb_keyspace.list_collections() 
-        for collection in collections:
-            if collection.name == collection_name:
-                return True
-        return False
+        return astradb.collection_exists(collection_name)
     elif vector_db == "QDRANT":
         return qdrant_client.collection_exists(collection_name)
     else:
@@ -80,9 +99,29 @@ def create_collection_if_not_exists(user_email: str):
         return
     collection_name = md5_b64(user_email)
     if vector_db == "ASTRADB":
-        astradb_keyspace.create_collection(collection_name)
+        astradb.create_collection(collection_name)
     elif vector_db == "QDRANT":
-        qdrant_client.create_collection(collection_name)
+        if matryoshka_embeddings:
+            # keep only the truncated vectors in RAM & indexed, the full vectors
+            # live on disk and are only read to rescore the first stage candidates
+            vectors_config = {
+                MATRYOSHKA_VECTOR_NAME: models.VectorParams(
+                    size=MATRYOSHKA_DIMENSIONS,
+                    distance=models.Distance.COSINE,
+                ),
+                FULL_VECTOR_NAME: models.VectorParams(
+                    size=EMBEDDING_DIMENSIONS,
+                    distance=models.Distance.COSINE,
+                    on_disk=True,
+                    hnsw_config=models.HnswConfigDiff(m=0),
+                ),
+            }
+        else:
+            vectors_config = models.VectorParams(
+                size=EMBEDDING_DIMENSIONS,
+                distance=models.Distance.COSINE,
+            )
+        qdrant_client.create_collection(collection_name, vectors_config=vectors_config)
     else:
         raise ValueError(f"Invalid vector db: {vector_db}")
 
@@ -96,6 +135,8 @@ def get_vector_store(user_email: str):
             embedding=embeddings,
             api_endpoint=os.getenv("ASTRA_DB_API_ENDPOINT"),
             token=os.getenv("ASTRA_DB_APPLICATION_TOKEN"),
+            namespace=os.getenv("ASTRA_DB_KEYSPACE"),
+            environment=os.getenv("ASTRA_DB_ENVIRONMENT", "prod"),
         )
     elif vector_db == "QDRANT":
         return QdrantVectorStore(
@@ -1,21 +1,81 @@
+import hashlib
 import os
-from typing import Any, Dict
+import uuid
+from typing import Any, Dict, List
 
+from app.core import astradb, matryoshka
+from app.core.admission import BACKGROUND, AdmissionRejectedError, admission
+from app.core.chunking import detect_document_type, split_documents
 from app.core.constants import (
     create_collection_if_not_exists,
+    embeddings,
     get_vector_store,
-    text_splitter,
     info_logger,
+    md5_b64,
+    redis_client,
+    vector_db,
 )
 from langchain_community.document_loaders import PyPDFLoader
+from langchain_core.documents import Document
 
+# namespace for the deterministic chunk ids
+CHUNK_ID_NAMESPACE = uuid.UUID("6f1c1f7e-3c1d-4f1e-9a55-0b9f6c2d4a10")
 
-def ingest_pdf(file_path: str, user_email: str) -> Dict[str, Any]:
+
+# redis key of the manifest (content hash -> chunk id) of a stored document
+def manifest_key(collection_name: str, document_name: str) -> str:
+    return f"document_manifest:{collection_name}:{document_name}"
+
+
+# redis key of the versions of all the documents of a collection
+def versions_key(collection_name: str) -> str:
+    return f"document_versions:{collection_name}"
+
+
+# hash the content of a chunk
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+# deterministic chunk id, so re-uploading the same chunk overwrites it instead of duplicating it
+def chunk_id(collection_name: str, document_name: str, chunk_hash: str) -> str:
+    return str(uuid.uuid5(CHUNK_ID_NAMESPACE, f"{collection_name}:{document_name}:{chunk_hash}"))
+
+
+# store the new chunks & delete the stale ones of the user's collection
+def _apply_changes(user_email: str, added: List[Document], added_ids: List[str], deleted_ids: List[str]):
+    if matryoshka.is_matryoshka_collection(user_email):
+        if added:
+            matryoshka.add_documents(user_email, added, ids=added_ids)
+        if deleted_ids:
+            matryoshka.delete_documents(user_email, deleted_ids)
+    elif vector_db == "ASTRADB":
+        collection_name = md5_b64(user_email)
+        if added:
+            vectors = embeddings.embed_documents([doc.page_content for doc in added])
+            astradb.add_documents(collection_name, added, vectors, added_ids)
+        if deleted_ids:
+            astradb.delete_documents(collection_name, deleted_ids)
+    else:
+        vector_store = get_vector_store(user_email)
+        if added:
+            vector_store.add_documents(added, ids=added_ids)
+        if deleted_ids:
+            vector_store.delete(ids=deleted_ids)
+
+
+def ingest_pdf(file_path: str, user_email: str, document_name: str) -> Dict[str, Any]:
     """
     Process and ingest a PDF file
 
+    A document that was already ingested under the same name is diffed against
+    its stored version by chunk content hash: only new or changed chunks are
+    embedded, and chunks that are gone are deleted.
+
     Args:
         file_path: Path to the PDF file
+        user_email: Email of the user owning the document
+        document_name: Name of the document, used to match re-uploads
 
     Returns:
         Dict containing ingestion status and metadata
@@ -25,18 +85,65 @@ def ingest_pdf(file_path: str, user_email: str) -> Dict[str, Any]:
         loader = PyPDFLoader(file_path)
         docs = loader.load()
 
-        # 2. chunk the data
-        chunks = text_splitter.split_documents(docs)
+        # 2. chunk the data, chunk size & overlap depend on the type of the document
+        document_type = detect_document_type(docs)
+        chunks = split_documents(docs, document_type=document_type)
 
-        # 3. generate vector embeddings for the data & store in Qdrant
-        create_collection_if_not_exists(user_email)
-        vector_store = get_vector_store(user_email)
-        vector_store.add_documents(chunks)
+        # 3. diff the chunks against the stored version of the document
+        collection_name = md5_b64(user_email)
+        current = {}
+        for chunk in chunks:
+            chunk_hash = content_hash(chunk.page_content)
+            # identical chunks have identical embeddings, keep the first one only
+            if chunk_hash not in current:
+                chunk.metadata["document_name"] = document_name
+                chunk.metadata["content_hash"] = chunk_hash
+                current[chunk_hash] = chunk
+
+        stored = {
+            key.decode("utf-8"): value.decode("utf-8")
+            for key, value in redis_client.hgetall(manifest_key(collection_name, document_name)).items()
+        }
+        added_hashes = [chunk_hash for chunk_hash in current if chunk_hash not in stored]
+        deleted_hashes = [chunk_hash for chunk_hash in stored if chunk_hash not in current]
+        added_ids = [chunk_id(collection_name, document_name, h) for h in added_hashes]
+        deleted_ids = [stored[h] for h in deleted_hashes]
+
+        # 4. embed & store only the new chunks, delete the stale ones in bulk
+        # unchanged chunks keep their stored metadata (e.g. page) even if they moved
+        # ingestion queues behind the interactive asks for the upstream slots
+        with admission.slot("embeddings", BACKGROUND), admission.slot("vectordb", BACKGROUND):
+            create_collection_if_not_exists(user_email)
+            _apply_changes(
+                user_email,
+                [current[h] for h in added_hashes],
+                added_ids,
+                deleted_ids,
+            )
+
+        # 5. update the manifest once the vector db is up to date
+        pipeline = redis_client.pipeline()
+        if deleted_hashes:
+            pipeline.hdel(manifest_key(collection_name, document_name), *deleted_hashes)
+        if added_hashes:
+            pipeline.hset(
+                manifest_key(collection_name, document_name),
+                mapping=dict(zip(added_hashes, added_ids)),
+            )
+        pipeline.hincrby(versions_key(collection_name), document_name, 1)
+        version = pipeline.execute()[-1]
 
         return {
             "pages": len(docs),
             "chunks": len(chunks),
+            "document_type": document_type,
+            "version": version,
+            "chunks_added": len(added_hashes),
+            "chunks_deleted": len(deleted_hashes),
+            "chunks_unchanged": len(current) - len(added_hashes),
             "size": os.path.getsize(file_path),
         }
+    except AdmissionRejectedError:
+        raise
     except Exception as e:
         raise Exception(f"Error ingesting PDF file: {str(e)}")
@@ -0,0 +1,145 @@
+# Matryoshka (truncated) embeddings for qdrant collections
+# text-embedding-3-small is trained so that a prefix of the embedding is itself
+# a usable embedding, so we index a short prefix for the ANN search & keep the
+# full vector on disk to rescore the best candidates
+# steps:
+# 1. embed the text once with the full dimensions
+# 2. truncate & re-normalize the vector to get the low dimension vector
+# 3. search the low dimension vectors for the top candidates
+# 4. rescore the candidates with the full vectors and keep the top k
+import uuid
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from app.core.config import (
+    FULL_VECTOR_NAME,
+    MATRYOSHKA_CANDIDATES,
+    MATRYOSHKA_DIMENSIONS,
+    MATRYOSHKA_VECTOR_NAME,
+)
+from app.core.constants import embeddings, md5_b64, qdrant_client, vector_db
+from langchain_core.documents import Document
+from qdrant_client import models
+
+# payload keys used by langchain's QdrantVectorStore, kept the same so both layouts look alike
+CONTENT_PAYLOAD_KEY = "page_content"
+METADATA_PAYLOAD_KEY = "metadata"
+
+# number of points upserted per request
+UPSERT_BATCH_SIZE = 64
+
+# collection name -> whether it uses the matryoshka layout
+_collection_layouts = {}
+
+
+# truncate the embeddings to the given dimensions and re-normalize them
+def truncate_embeddings(vectors: np.ndarray, dimensions: int = MATRYOSHKA_DIMENSIONS) -> np.ndarray:
+    truncated = np.asarray(vectors, dtype=np.float32)[..., :dimensions]
+    norms = np.linalg.norm(truncated, axis=-1, keepdims=True)
+    return truncated / np.maximum(norms, 1e-12)
+
+
+# check if the user's collection was created with the matryoshka layout
+def is_matryoshka_collection(user_email: str) -> bool:
+    if vector_db != "QDRANT":
+        return False
+    collection_name = md5_b64(user_email)
+    if collection_name not in _collection_layouts:
+        vectors = qdrant_client.get_collection(collection_name).config.params.vectors
+        _collection_layouts[collection_name] = (
+            isinstance(vectors, dict) and MATRYOSHKA_VECTOR_NAME in vectors
+        )
+    return _collection_layouts[collection_name]
+
+
+# embed the documents and upsert both the truncated and the full vectors
+def add_documents(
+    user_email: str, documents: List[Document], ids: Optional[Sequence[str]] = None
+) -> List[str]:
+    collection_name = md5_b64(user_email)
+    ids = list(ids) if ids is not None else [uuid.uuid4().hex for _ in documents]
+
+    for start in range(0, len(documents), UPSERT_BATCH_SIZE):
+        batch = documents[start : start + UPSERT_BATCH_SIZE]
+        full = np.asarray(
+            embeddings.embed_documents([doc.page_content for doc in batch]),
+            dtype=np.float32,
+        )
+        truncated = truncate_embeddings(full)
+        points = [
+            models.PointStruct(
+                id=point_id,
+                vector={
+                    MATRYOSHKA_VECTOR_NAME: truncated[i].tolist(),
+                    FULL_VECTOR_NAME: full[i].tolist(),
+                },
+                payload={
+                    CONTENT_PAYLOAD_KEY: doc.page_content,
+                    METADATA_PAYLOAD_KEY: doc.metadata,
+                },
+            )
+            for i, (point_id, doc) in enumerate(
+                zip(ids[start : start + UPSERT_BATCH_SIZE], batch)
+            )
+        ]
+        qdrant_client.upsert(collection_name=collection_name, points=points)
+
+    return ids
+
+
+# delete the points of the given ids in bulk
+def delete_documents(user_email: str, ids: Sequence[str]) -> None:
+    qdrant_client.delete(
+        collection_name=md5_b64(user_email),
+        points_selector=models.PointIdsList(points=list(ids)),
+    )
+
+
+# two stage search for an already embedded query: ANN over the truncated vectors,
+# rescored with the full vectors
+def similarity_search_with_score_by_vector(
+    vector: Sequence[float],
+    user_email: str,
+    k: int = 5,
+    candidates: int = MATRYOSHKA_CANDIDATES,
+) -> List[Tuple[Document, float]]:
+    collection_name = md5_b64(user_email)
+    full = np.asarray(vector, dtype=np.float32)
+    points = qdrant_client.query_points(
+        collection_name=collection_name,
+        prefetch=models.Prefetch(
+            query=truncate_embeddings(full).tolist(),
+            using=MATRYOSHKA_VECTOR_NAME,
+            limit=max(candidates, k),
+        ),
+        query=full.tolist(),
+        using=FULL_VECTOR_NAME,
+        limit=k,
+        with_payload=True,
+    ).points
+    return [(_document_from_point(point), point.score) for point in points]
+
+
+# exact search over the full vectors, used to measure the recall of the two stage search
+def exact_search_with_score_by_vector(
+    vector: Sequence[float], user_email: str, k: int = 5
+) -> List[Tuple[Document, float]]:
+    points = qdrant_client.query_points(
+        collection_name=md5_b64(user_email),
+        query=np.asarray(vector, dtype=np.float32).tolist(),
+        using=FULL_VECTOR_NAME,
+        limit=k,
+        with_payload=True,
+        search_params=models.SearchParams(exact=True),
+    ).points
+    return [(_document_from_point(point), point.score) for point in points]
+
+
+# build a langchain document from a qdrant point
+def _document_from_point(point: models.ScoredPoint) -> Document:
+    metadata = point.payload.get(METADATA_PAYLOAD_KEY) or {}
+    metadata["_id"] = point.id
+    return Document(
+        page_content=point.payload.get(CONTENT_PAYLOAD_KEY, ""),
+        metadata=metadata,
+    )
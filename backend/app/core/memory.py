@@ -0,0 +1,199 @@
+# Server side conversation memory, kept in redis per user & session
+# every session keeps its last turns verbatim & a rolling summary of the older
+# ones, so the history sent with a question stays under a fixed token budget
+# however long the chat gets
+# steps:
+# 1. load the summary & the recent turns that fit the history budget
+# 2. rewrite a follow-up question into a standalone one for the retrieval
+# 3. store the new turn, turns out of the recent window are folded into the
+#    summary in the background, so it doesn't add to the answer latency
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+from app.core.admission import BACKGROUND, INTERACTIVE
+from app.core.config import (
+    CONVERSATION_HISTORY_TOKEN_BUDGET,
+    CONVERSATION_RECENT_TURNS,
+    CONVERSATION_SUMMARY_MAX_TOKENS,
+    CONVERSATION_TTL_SECONDS,
+    CONVERSATION_TURN_MAX_TOKENS,
+    LLM_MODEL,
+    MODEL_TIERS,
+)
+from app.core.constants import error_logger, llms, md5_b64, redis_client
+from app.core.metrics import metrics
+from app.core.resilience import guarded_call
+from app.core.tokens import count_tokens, get_encoding
+
+# questions referring to the earlier conversation: opening with a connective
+# ("and for the admins?", "what about march?") or a short question leaning on a
+# pronoun ("who signed it?"), longer questions are almost always standalone
+FOLLOW_UP_OPENER_PATTERN = re.compile(
+    r"^(and|but|so|also|then|what about|how about|what else)\b", re.IGNORECASE
+)
+FOLLOW_UP_REFERENCE_PATTERN = re.compile(
+    r"\b(it|its|this|that|these|those|they|them|their|the same|the above|the former|the latter)\b",
+    re.IGNORECASE,
+)
+FOLLOW_UP_MAX_WORDS = 6
+
+REWRITE_PROMPT = (
+    "Rewrite the user's last question as a standalone question that can be understood "
+    "without the conversation. Keep the wording of the question where possible and reply "
+    "with the question only."
+)
+SUMMARY_PROMPT = (
+    "Update the summary of a conversation with its next turns. Keep the facts, names, numbers "
+    "and goals of the user that later questions may refer to, drop the rest. "
+    "Reply with the updated summary only."
+)
+REWRITE_MAX_TOKENS = 100
+
+# threads folding the old turns into the summaries
+_summarizer = ThreadPoolExecutor(max_workers=4, thread_name_prefix="summarizer")
+
+
+# redis key prefix of a conversation
+def session_key(user_email: str, session_id: str) -> str:
+    return f"conversation:{md5_b64(user_email)}:{session_id}"
+
+
+# cut the text to at most max_tokens tokens
+def _truncate(text: str, max_tokens: int) -> str:
+    encoding = get_encoding(LLM_MODEL)
+    tokens = encoding.encode_ordinary(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens]).rstrip() + " ..."
+
+
+# format the turns as a plain transcript for the tiny tier prompts
+def _transcript(messages: List[Tuple[str, str]]) -> str:
+    return "\n".join(f"{role}: {content}" for role, content in messages)
+
+
+# call the tiny tier with its admission slot, deadline & circuit breaker
+def _invoke_tiny(messages: List[Tuple[str, str]], max_tokens: int, priority: int) -> str:
+    response = guarded_call(
+        f"llm:{MODEL_TIERS['tiny']}", llms["tiny"].invoke, messages, priority=priority, max_tokens=max_tokens
+    )
+    return response.content.strip()
+
+
+# check if the question likely depends on the earlier conversation
+def is_follow_up(query: str) -> bool:
+    query = query.strip()
+    if FOLLOW_UP_OPENER_PATTERN.match(query):
+        return True
+    return len(query.split()) <= FOLLOW_UP_MAX_WORDS and bool(FOLLOW_UP_REFERENCE_PATTERN.search(query))
+
+
+# load the history of the session as messages & their number of tokens
+def load_history(user_email: str, session_id: str) -> Tuple[List[Tuple[str, str]], int]:
+    key = session_key(user_email, session_id)
+    pipeline = redis_client.pipeline()
+    pipeline.get(f"{key}:summary")
+    pipeline.lrange(f"{key}:turns", -CONVERSATION_RECENT_TURNS, -1)
+    summary, turns = pipeline.execute()
+
+    messages, used = [], 0
+    if summary:
+        summary = summary.decode("utf-8")
+        used += count_tokens(summary, LLM_MODEL)
+        messages.append(("system", f"Summary of the earlier conversation:\n{summary}"))
+
+    # newest turns first, until the history budget is used up
+    recent = []
+    for turn in map(json.loads, reversed(turns)):
+        if used + turn["tokens"] > CONVERSATION_HISTORY_TOKEN_BUDGET:
+            break
+        recent.insert(0, turn)
+        used += turn["tokens"]
+    for turn in recent:
+        messages += [("user", turn["question"]), ("assistant", turn["answer"])]
+
+    metrics.observe("history_tokens", used)
+    return messages, used
+
+
+# rewrite a follow-up question into a standalone question for the retrieval,
+# the question is used as is if the rewrite fails
+def rewrite_query(query: str, history: List[Tuple[str, str]]) -> str:
+    if not history or not is_follow_up(query):
+        return query
+    try:
+        rewritten = _invoke_tiny(
+            [
+                ("system", REWRITE_PROMPT),
+                ("user", f"Conversation:\n{_transcript(history)}\n\nLast question: {query}"),
+            ],
+            REWRITE_MAX_TOKENS,
+            INTERACTIVE,
+        )
+    except Exception as e:
+        error_logger.error(f"Query rewrite failed, retrieving with the question: {e}")
+        metrics.increment("degraded_answers", reason="rewrite")
+        return query
+    metrics.increment("queries_rewritten")
+    return rewritten or query
+
+
+# fold the turns out of the recent window into the summary
+def _fold_turns(key: str) -> None:
+    # a fold already running for the session picks these turns up on the next turn
+    lock = redis_client.lock(f"{key}:lock", timeout=60)
+    if not lock.acquire(blocking=False):
+        return
+    try:
+        turns = redis_client.lrange(f"{key}:turns", 0, -1)
+        evicted = [json.loads(turn) for turn in turns[:-CONVERSATION_RECENT_TURNS]]
+        if not evicted:
+            return
+        summary = (redis_client.get(f"{key}:summary") or b"").decode("utf-8")
+        messages = [
+            message
+            for turn in evicted
+            for message in (("user", turn["question"]), ("assistant", turn["answer"]))
+        ]
+        summary = _invoke_tiny(
+            [
+                ("system", SUMMARY_PROMPT),
+                ("user", f"Summary:\n{summary or '(empty)'}\n\nNext turns:\n{_transcript(messages)}"),
+            ],
+            CONVERSATION_SUMMARY_MAX_TOKENS,
+            BACKGROUND,
+        )
+
+        pipeline = redis_client.pipeline()
+        pipeline.set(f"{key}:summary", summary, ex=CONVERSATION_TTL_SECONDS)
+        # only the folded turns are removed, new turns may have been added meanwhile
+        pipeline.ltrim(f"{key}:turns", len(evicted), -1)
+        pipeline.execute()
+        metrics.increment("conversation_summaries")
+    except Exception as e:
+        error_logger.error(f"Failed to summarize conversation {key}: {e}")
+    finally:
+        lock.release()
+
+
+# store the turn & refresh the expiry of the session
+def add_turn(user_email: str, session_id: str, query: str, answer: str) -> None:
+    key = session_key(user_email, session_id)
+    question = _truncate(query, CONVERSATION_TURN_MAX_TOKENS // 2)
+    answer = _truncate(answer, CONVERSATION_TURN_MAX_TOKENS - count_tokens(question, LLM_MODEL))
+    turn = {
+        "question": question,
+        "answer": answer,
+        "tokens": count_tokens(question, LLM_MODEL) + count_tokens(answer, LLM_MODEL),
+    }
+
+    pipeline = redis_client.pipeline()
+    pipeline.rpush(f"{key}:turns", json.dumps(turn))
+    pipeline.expire(f"{key}:turns", CONVERSATION_TTL_SECONDS)
+    pipeline.expire(f"{key}:summary", CONVERSATION_TTL_SECONDS)
+    length = pipeline.execute()[0]
+
+    if length > CONVERSATION_RECENT_TURNS:
+        _summarizer.submit(_fold_turns, key)
@@ -0,0 +1,77 @@
+# In-process metrics for the backend, exposed as json on GET /metrics
+# counters & gauges keep a single value, observations keep a rolling window
+# of samples to report the count, mean & latency percentiles
+import threading
+from collections import defaultdict, deque
+from typing import Any, Dict
+
+import numpy as np
+
+# number of samples kept per observed metric
+OBSERVATION_WINDOW = 1024
+
+
+class Metrics:
+    """Thread safe registry of counters, gauges and observations"""
+
+    def __init__(self, window: int = OBSERVATION_WINDOW):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._gauges = {}
+        self._observations = defaultdict(lambda: deque(maxlen=window))
+        self._observation_counts = defaultdict(int)
+
+    # build the metric key from its name & labels, e.g. llm_requests{route="lookup"}
+    @staticmethod
+    def _key(name: str, labels: Dict[str, Any]) -> str:
+        if not labels:
+            return name
+        return name + "{" + ",".join(f'{k}="{v}"' for k, v in sorted(labels.items())) + "}"
+
+    def increment(self, name: str, value: float = 1, **labels) -> None:
+        with self._lock:
+            self._counters[self._key(name, labels)] += value
+
+    def set_gauge(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self._gauges[self._key(name, labels)] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            self._observations[key].append(value)
+            self._observation_counts[key] += 1
+
+    # total number of observations of the metric
+    def observation_count(self, name: str, **labels) -> int:
+        with self._lock:
+            return self._observation_counts.get(self._key(name, labels), 0)
+
+    # percentile of the recent observations, None if nothing was observed yet
+    def percentile(self, name: str, q: float, **labels) -> Any:
+        with self._lock:
+            samples = list(self._observations.get(self._key(name, labels), ()))
+        return float(np.percentile(samples, q)) if samples else None
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            observations = {key: list(samples) for key, samples in self._observations.items()}
+            counts = dict(self._observation_counts)
+            snapshot = {"counters": dict(self._counters), "gauges": dict(self._gauges)}
+
+        snapshot["observations"] = {
+            key: {
+                "count": counts[key],
+                "mean": float(np.mean(samples)),
+                "p50": float(np.percentile(samples, 50)),
+                "p95": float(np.percentile(samples, 95)),
+                "p99": float(np.percentile(samples, 99)),
+            }
+            for key, samples in observations.items()
+            if samples
+        }
+        return snapshot
+
+
+# metrics registry shared by the whole process
+metrics = Metrics()
@@ -0,0 +1,182 @@
+# Prompt assembly for the LLM call
+# the system message is a fixed, byte-identical prefix of more than 1024 tokens so that
+# the provider can cache it across requests (OpenAI only caches prompt prefixes of 1024+
+# tokens), all the per-request data (conversation history, retrieved documents & question)
+# goes after it
+# steps:
+# 1. compact the retrieved documents & drop duplicates
+# 2. add the documents in score order until the token budget is used up
+# 3. put the documents & the question into the user message, after the history
+import hashlib
+import logging
+import re
+from typing import List, Optional, Tuple
+
+from app.core.config import LLM_MODEL, PROMPT_CONTEXT_TOKEN_BUDGET, PROMPT_MIN_DOCUMENT_TOKENS
+from app.core.tokens import get_encoding
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage
+
+# the logger of constants, without importing it, constants connects all the clients
+# & the offline benchmarks build prompts without a .env
+info_logger = logging.getLogger("uvicorn.info")
+
+# the fixed instructions & examples, kept well above OpenAI's 1024 token caching threshold
+# (about 6,000 characters, 1,300+ tokens), a shorter prefix is never cached & every request
+# pays for it in full, so check the length with get_encoding(LLM_MODEL) when editing it
+SYSTEM_PROMPT = (
+    "You are a helpful AI assistant that answers the user's questions about the documents they uploaded.\n"
+    "If there aren't any related documents, or if the user's query is not related to the documents, "
+    "then you can provide the answer based on your knowledge. "
+    "Think carefully before answering the user's question.\n"
+    "\n"
+    "How the request is laid out:\n"
+    "- The documents, if any, are listed as numbered entries before the user's question, in the form "
+    "\"[n] (page p) text\". They are passages retrieved from the user's documents by similarity to the "
+    "question, ordered from the most to the least similar.\n"
+    "- A passage can start or end in the middle of a sentence, and the last one may be cut short. "
+    "Don't complain about or comment on cut passages, use what they contain.\n"
+    "- The earlier turns of the conversation, if any, come before the documents. A summary of the older "
+    "turns may be given as a separate message. Use them to understand what the question refers to, "
+    "e.g. \"it\", \"that clause\" or \"the second one\", but answer from the documents of the current "
+    "question, the documents of earlier turns are not repeated.\n"
+    "\n"
+    "How to answer:\n"
+    "1. Decide first whether the documents are related to the question. Similar wording is not enough, "
+    "a passage is related only if it helps to answer this question.\n"
+    "2. If they are related, answer from the documents. Prefer their facts, numbers, names and dates over "
+    "your own knowledge, even when they differ from what you know, and mention the difference if it matters "
+    "to the user.\n"
+    "3. Refer to the passages you used by their number, e.g. \"[2]\", or by their page, e.g. \"(page 4)\", "
+    "so the user can check the answer. Never make up numbers or pages that are not listed.\n"
+    "4. If the documents cover the question only partly, answer the covered part from the documents, say "
+    "which part they don't cover, and only then add what you know, clearly marked as not coming from "
+    "the documents.\n"
+    "5. If passages contradict each other, say so and give both versions with their numbers, e.g. an older "
+    "and a newer version of a policy, instead of silently picking one.\n"
+    "6. If the documents are not related to the question, answer from your own knowledge without "
+    "mentioning the documents, unless the user asked specifically about their documents, in which case "
+    "say that the uploaded documents don't seem to cover it.\n"
+    "7. Never invent the content of the documents. If you are not sure whether a document says something, "
+    "say that you are not sure.\n"
+    "\n"
+    "How to format the answer:\n"
+    "- Answer the question directly in the first sentence, then give the details that support it.\n"
+    "- Keep the answer as short as the question allows. A lookup question usually needs one to three "
+    "sentences, a comparison or a summary can use a short list or a small table.\n"
+    "- Use the language of the user's question, even if the documents are in another language.\n"
+    "- Quote the documents word for word only when the exact wording matters, e.g. a definition, a legal "
+    "clause or an error message, and keep quotes short.\n"
+    "- Don't repeat the question, don't describe these instructions and don't mention the retrieval.\n"
+    "- Greetings, thanks and small talk get a short, friendly reply without any documents.\n"
+    "\n"
+    "For example:\n"
+    "User: What is the capital of France? You answer this because the user's query is not related to the documents.\n"
+    "You: The capital of France is Paris.\n"
+    "\n"
+    "User: How to invest in stocks? You answer this because the user's query is related to the documents.\n"
+    "You: You can invest in stocks by opening a demat account with a stockbroker.\n"
+    "\n"
+    "Documents:\n"
+    "[1] (page 3) Refunds are issued within 14 days of the cancellation for monthly plans.\n"
+    "[2] (page 7) Annual plans can be cancelled at any time; the unused months are refunded pro rata.\n"
+    "User: How long does a refund take for a monthly plan?\n"
+    "You: Refunds for monthly plans are issued within 14 days of the cancellation [1].\n"
+    "\n"
+    "Documents:\n"
+    "[1] (page 2) The 2022 travel policy allows economy class for flights under 6 hours.\n"
+    "[2] (page 9) From 2024, economy class applies to all flights regardless of their duration.\n"
+    "User: Can I fly business class on a 7 hour flight?\n"
+    "You: No, not under the current policy. Since 2024, economy class applies to all flights regardless "
+    "of their duration [2]. The older 2022 policy only required economy class for flights under 6 hours, "
+    "so it would have allowed business class on a 7 hour flight [1].\n"
+    "\n"
+    "Documents:\n"
+    "[1] (page 5) The warranty covers manufacturing defects for 24 months from the date of purchase.\n"
+    "User: Does the warranty cover water damage, and how do I file a claim?\n"
+    "You: The documents only say that the warranty covers manufacturing defects for 24 months from the "
+    "date of purchase [1]. They don't mention water damage or how to file a claim. Generally, water damage "
+    "is not treated as a manufacturing defect, and claims are filed with the seller or the manufacturer "
+    "with the proof of purchase, but check the full warranty terms to be sure.\n"
+    "\n"
+    "Documents:\n"
+    "[1] (page 4) The Basic plan includes 5 users, 10 GB of storage and email support.\n"
+    "[2] (page 4) The Pro plan includes 25 users, 100 GB of storage, phone support and single sign-on.\n"
+    "[3] (page 6) Both plans are billed per month and can be upgraded at any time.\n"
+    "User: Compare the Basic and Pro plans.\n"
+    "You: The Pro plan supports more users and storage and adds phone support and single sign-on [1][2]:\n"
+    "- Users: 5 on Basic, 25 on Pro.\n"
+    "- Storage: 10 GB on Basic, 100 GB on Pro.\n"
+    "- Support: email on Basic, phone on Pro.\n"
+    "- Single sign-on: only on Pro.\n"
+    "Both are billed monthly, and you can upgrade from Basic to Pro at any time [3].\n"
+    "\n"
+    "Earlier conversation:\n"
+    "User: Who signed the supplier agreement?\n"
+    "You: It was signed by Jane Doe, the head of procurement [1].\n"
+    "Documents:\n"
+    "[1] (page 12) This agreement may be terminated by either party with 90 days written notice.\n"
+    "User: Can they terminate it early?\n"
+    "You: Yes, either party can terminate the supplier agreement with 90 days written notice [1]."
+)
+
+HORIZONTAL_WHITESPACE = re.compile(r"[ \t\r\f\v]+")
+BLANK_LINES = re.compile(r"\s*\n\s*")
+
+
+# collapse the whitespace of a document into single spaces & newlines
+def compact(text: str) -> str:
+    return BLANK_LINES.sub("\n", HORIZONTAL_WHITESPACE.sub(" ", text)).strip()
+
+
+# format the documents as a compact, numbered context within the token budget
+def build_context(docs: List[Document], token_budget: int = PROMPT_CONTEXT_TOKEN_BUDGET) -> Tuple[str, int]:
+    encoding = get_encoding(LLM_MODEL)
+    entries, seen, used = [], set(), 0
+
+    for doc in docs:
+        text = compact(doc.page_content)
+        key = hashlib.sha1(text.lower().encode("utf-8")).digest()
+        # skip exact duplicates & documents already contained in a kept one
+        if not text or key in seen or any(text in entry for entry in entries):
+            continue
+        seen.add(key)
+
+        page = doc.metadata.get("page")
+        label = f"[{len(entries) + 1}]" if page is None else f"[{len(entries) + 1}] (page {page + 1})"
+        tokens = encoding.encode_ordinary(f"{label} {text}\n")
+        if used + len(tokens) > token_budget:
+            # cut the document at a token boundary if enough of it still fits
+            remaining = token_budget - used
+            if remaining >= PROMPT_MIN_DOCUMENT_TOKENS:
+                entries.append(encoding.decode(tokens[:remaining]).rstrip())
+                used += remaining
+            break
+        entries.append(f"{label} {text}")
+        used += len(tokens)
+
+    return "\n".join(entries), used
+
+
+# build the messages for the LLM, the system message never changes between requests
+def build_messages(
+    query: str, docs: List[Document], history: Optional[List[Tuple[str, str]]] = None
+) -> Tuple[List[Tuple[str, str]], int]:
+    context, context_tokens = build_context(docs)
+    info_logger.info(f"Prompt context: {len(docs)} documents, {context_tokens} tokens")
+    if context:
+        user_message = f"Documents:\n{context}\n\nQuestion: {query}"
+    else:
+        user_message = query
+    return [("system", SYSTEM_PROMPT), *(history or []), ("user", user_message)], context_tokens
+
+
+# log the prompt, cached & completion tokens reported by the provider
+def log_token_usage(response: AIMessage) -> None:
+    usage = response.usage_metadata or {}
+    cached_tokens = (usage.get("input_token_details") or {}).get("cache_read", 0)
+    info_logger.info(
+        f"LLM usage: prompt tokens: {usage.get('input_tokens', 0)}, "
+        f"cached tokens: {cached_tokens}, "
+        f"completion tokens: {usage.get('output_tokens', 0)}"
+    )
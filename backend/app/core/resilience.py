@@ -0,0 +1,233 @@
+# Tail latency controls for the upstream calls (embeddings, vector db & LLM)
+# - every call gets a deadline: the smaller of its upstream timeout and what is
+#   left of the request budget, the caller stops waiting once it passes
+# - idempotent calls can be hedged: if the first attempt is slower than the
+#   upstream's recent p95, a second attempt is sent and the first answer wins
+# - every upstream has a circuit breaker, after repeated failures calls fail
+#   fast for a while instead of waiting on a degraded dependency
+# - every attempt holds an admission slot of its upstream until the call itself
+#   returns, so abandoned & hedged attempts count against the upstream's limit
+import contextvars
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Any, Callable, Optional
+
+from app.core.admission import INTERACTIVE, AdmissionRejectedError, UpstreamLimiter, admission
+from app.core.config import (
+    ADMISSION_LIMITS,
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+    CIRCUIT_BREAKER_RESET_SECONDS,
+    HEDGE_MIN_SAMPLES,
+    HEDGE_PERCENTILE,
+    UPSTREAM_TIMEOUTS,
+)
+from app.core.constants import error_logger
+from app.core.metrics import metrics
+
+# absolute deadline (time.monotonic) of the current request
+_request_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+# threads running the upstream calls, so the caller can stop waiting on them
+# one pool per upstream, abandoned calls of a slow upstream can't delay the others
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+# Custom exception for upstream calls that can't be served
+class UpstreamUnavailableError(Exception):
+    """Custom exception for upstream calls that timed out or hit an open circuit"""
+
+    def __init__(self, message: str, upstream: str):
+        self.message = message
+        self.upstream = upstream
+        super().__init__(self.message)
+
+
+class CircuitBreaker:
+    """Opens after consecutive failures, lets a single trial call through once the reset time passed"""
+
+    def __init__(self, name: str, failure_threshold: int, reset_seconds: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def _report(self, state: str) -> None:
+        metrics.set_gauge(
+            "circuit_breaker_open", 0 if state == "closed" else 1, upstream=self.name
+        )
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at < self.reset_seconds or self._trial_running:
+                metrics.increment("circuit_breaker_rejected", upstream=self.name)
+                raise UpstreamUnavailableError(f"{self.name} circuit is open", self.name)
+            # half open, let this call through as a trial
+            self._trial_running = True
+
+    # the trial call never reached the upstream, let the next call be the trial
+    def abandon_trial(self) -> None:
+        with self._lock:
+            self._trial_running = False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+            self._report("closed")
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    error_logger.error(f"Circuit breaker opened for {self.name}")
+                self._opened_at = time.monotonic()
+                self._report("open")
+
+
+# circuit breakers by upstream name
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(upstream: str) -> CircuitBreaker:
+    with _breakers_lock:
+        if upstream not in _breakers:
+            _breakers[upstream] = CircuitBreaker(
+                upstream, CIRCUIT_BREAKER_FAILURE_THRESHOLD, CIRCUIT_BREAKER_RESET_SECONDS
+            )
+        return _breakers[upstream]
+
+
+def get_executor(upstream: str) -> ThreadPoolExecutor:
+    name = upstream.split(":")[0]
+    with _executors_lock:
+        if name not in _executors:
+            # the running calls hold admission slots, so they never queue in the pool
+            _executors[name] = ThreadPoolExecutor(
+                max_workers=ADMISSION_LIMITS[name]["slots"], thread_name_prefix=f"upstream-{name}"
+            )
+        return _executors[name]
+
+
+# set the latency budget of the current request
+@contextmanager
+def request_budget(seconds: float):
+    token = _request_deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _request_deadline.reset(token)
+
+
+# seconds left for a call to the upstream
+def call_timeout(upstream: str) -> float:
+    timeout = UPSTREAM_TIMEOUTS[upstream.split(":")[0]]
+    deadline = _request_deadline.get()
+    if deadline is not None:
+        timeout = min(timeout, deadline - time.monotonic())
+    return timeout
+
+
+# delay after which a second attempt is sent, None while there are too few samples
+def hedge_delay(upstream: str) -> Optional[float]:
+    if metrics.observation_count("upstream_latency_seconds", upstream=upstream) < HEDGE_MIN_SAMPLES:
+        return None
+    return metrics.percentile("upstream_latency_seconds", HEDGE_PERCENTILE, upstream=upstream)
+
+
+# run an attempt, its slot is released when the call returns, not when the caller stops waiting
+def _submit(upstream: str, limiter: UpstreamLimiter, fn: Callable, args, kwargs) -> Future:
+    start = time.monotonic()
+    future = get_executor(upstream).submit(fn, *args, **kwargs)
+    future.add_done_callback(lambda _: limiter.release(time.monotonic() - start))
+    return future
+
+
+# wait for the first successful attempt, hedging after the delay
+def _run(
+    upstream: str, limiter: UpstreamLimiter, fn: Callable, args, kwargs, timeout: float, hedge: bool
+) -> Any:
+    deadline = time.monotonic() + timeout
+    pending = {_submit(upstream, limiter, fn, args, kwargs)}
+
+    delay = hedge_delay(upstream) if hedge else None
+    if delay is not None and delay < timeout:
+        done, pending = wait(pending, timeout=delay)
+        if done:
+            pending = done
+        elif limiter.try_acquire():
+            metrics.increment("upstream_hedged", upstream=upstream)
+            pending.add(_submit(upstream, limiter, fn, args, kwargs))
+        else:
+            # no free slot, a hedge would only add to the load of a busy upstream
+            metrics.increment("upstream_hedge_skipped", upstream=upstream)
+
+    error = None
+    while pending:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+
+    if error is not None and not pending:
+        raise error
+    metrics.increment("upstream_timeouts", upstream=upstream)
+    raise UpstreamUnavailableError(f"{upstream} call timed out after {timeout:.2f}s", upstream)
+
+
+def _budget_exhausted(upstream: str) -> UpstreamUnavailableError:
+    metrics.increment("upstream_timeouts", upstream=upstream)
+    return UpstreamUnavailableError(f"request budget exhausted before the {upstream} call", upstream)
+
+
+# call the upstream with an admission slot, a deadline, an optional hedge & its circuit breaker
+def guarded_call(
+    upstream: str, fn: Callable, *args, hedge: bool = False, priority: int = INTERACTIVE, **kwargs
+) -> Any:
+    # checked before the breaker, a half open breaker would wait forever on a trial that never ran
+    if call_timeout(upstream) <= 0:
+        raise _budget_exhausted(upstream)
+
+    breaker = get_breaker(upstream)
+    breaker.before_call()
+
+    limiter = admission.limiters[upstream.split(":")[0]]
+    try:
+        limiter.acquire(priority)
+    except AdmissionRejectedError:
+        breaker.abandon_trial()
+        raise
+
+    # waiting for the slot used up part of the budget
+    timeout = call_timeout(upstream)
+    if timeout <= 0:
+        limiter.release(0)
+        breaker.abandon_trial()
+        raise _budget_exhausted(upstream)
+
+    start = time.monotonic()
+    try:
+        result = _run(upstream, limiter, fn, args, kwargs, timeout, hedge)
+    except Exception:
+        breaker.record_failure()
+        metrics.increment("upstream_failures", upstream=upstream)
+        raise
+
+    breaker.record_success()
+    metrics.observe("upstream_latency_seconds", time.monotonic() - start, upstream=upstream)
+    return result
@@ -3,58 +3,230 @@
 # steps:
 # 1. get the input query from user
 # 2. get the vector embeddings assocoated with that query
-# 3. generate a system prompt using the retrieved vector embeddings
-# 4. query the LLM to answer user's question
+# 3. build the prompt from the fixed instructions, the conversation history & the retrieved documents
+# 4. route the query to a model tier & query the LLM to answer user's question
+import re
+import threading
+import time
+from typing import List, Optional, Tuple
 
+from app.core.config import (
+    MODEL_TIERS,
+    REQUEST_BUDGET_SECONDS,
+    RETRIEVAL_HNSW_EF,
+    RETRIEVAL_K,
+    ROUTER_CONFIDENT_MARGIN,
+    ROUTER_MAX_INFLIGHT_LARGE,
+    ROUTER_SMALL_TIER_MAX_CONTEXT_TOKENS,
+    SIMILARITY_THRESHOLD,
+)
 from app.core.constants import (
     collection_exists,
     embeddings,
+    error_logger,
     get_vector_store,
     info_logger,
-    llm,
+    llms,
+    md5_b64,
     qdrant_client,
     redis_client,
+    vector_db,
 )
+from app.core import astradb, matryoshka
+from app.core.admission import INTERACTIVE, AdmissionRejectedError
+from app.core.memory import add_turn, load_history, rewrite_query
+from app.core.metrics import metrics
+from app.core.prompt import build_messages, log_token_usage
+from app.core.resilience import guarded_call, request_budget
+from langchain_core.documents import Document
 from langchain_qdrant import QdrantVectorStore
+from qdrant_client import models
+
+# Query classifier patterns
+# chitchat is only a query made entirely of greetings, thanks & the like, e.g. "ok, thanks!",
+# a greeting followed by a question ("hi, what is the refund policy?") still needs the documents
+CHITCHAT_PATTERN = re.compile(
+    r"^(?:(?:hi|hello|hey|yo|thanks|thank you|thx|ok|okay|cool|great|nice|bye|goodbye|"
+    r"good (?:morning|afternoon|evening|night)|how are you|who are you|what can you do)\b"
+    r"(?:\s+(?:there|again|so much|a lot|very much|everyone))?\W*)+$",
+    re.IGNORECASE,
+)
+SYNTHESIS_PATTERN = re.compile(
+    r"\b(compare|comparison|contrast|differences?|versus|vs\.?|summari[sz]e|summary|overview|"
+    r"explain why|why|pros and cons|trade-?offs?|advantages|disadvantages|analy[sz]e|"
+    r"implications?|relationship|step by step|all of the|list all|across)\b",
+    re.IGNORECASE,
+)
+CHITCHAT_MAX_WORDS = 6
+SYNTHESIS_MIN_WORDS = 30
+
+# number of large tier calls in flight, used to downgrade queries under load
+_inflight_large = 0
+_inflight_lock = threading.Lock()
+
 
-# Similarity threshold for considering a document relevant
-SIMILARITY_THRESHOLD = 0.60
+# cheap local classifier for the query: chitchat, lookup or synthesis
+def classify_query(query: str) -> str:
+    words = query.split()
+    if len(words) <= CHITCHAT_MAX_WORDS and CHITCHAT_PATTERN.match(query.strip()):
+        return "chitchat"
+    if (
+        len(words) >= SYNTHESIS_MIN_WORDS
+        or query.count("?") > 1
+        or SYNTHESIS_PATTERN.search(query)
+    ):
+        return "synthesis"
+    return "lookup"
+
+
+# pick the route & model tier for the query from its class and the retrieval outcome
+def route_query(query_class: str, top_score: Optional[float], context_tokens: int) -> Tuple[str, str]:
+    if query_class == "chitchat":
+        return "chitchat", "tiny"
+    if query_class == "synthesis":
+        return "synthesis", "large"
+    if top_score is None or top_score < SIMILARITY_THRESHOLD:
+        # nothing relevant was found, the answer comes from the model's own knowledge
+        return "no_context", "small"
+    if (
+        top_score >= SIMILARITY_THRESHOLD + ROUTER_CONFIDENT_MARGIN
+        and context_tokens <= ROUTER_SMALL_TIER_MAX_CONTEXT_TOKENS
+    ):
+        return "confident_lookup", "small"
+    return "lookup", "large"
+
+
+# call the LLM of the given tier, downgrading the large tier when too many calls are in flight
+def invoke_llm(messages, route: str, tier: str):
+    global _inflight_large
+
+    with _inflight_lock:
+        if tier == "large" and _inflight_large >= ROUTER_MAX_INFLIGHT_LARGE:
+            route, tier = f"{route}_degraded", "small"
+        if tier == "large":
+            _inflight_large += 1
+
+    labels = {"route": route, "model": MODEL_TIERS[tier]}
+    start = time.perf_counter()
+    try:
+        response = guarded_call(f"llm:{labels['model']}", llms[tier].invoke, messages, priority=INTERACTIVE)
+    finally:
+        if tier == "large":
+            with _inflight_lock:
+                _inflight_large -= 1
+
+    usage = response.usage_metadata or {}
+    metrics.increment("llm_route_requests", **labels)
+    metrics.observe("llm_route_latency_seconds", time.perf_counter() - start, **labels)
+    metrics.increment("llm_route_prompt_tokens", usage.get("input_tokens", 0), **labels)
+    metrics.increment("llm_route_completion_tokens", usage.get("output_tokens", 0), **labels)
+    info_logger.info(f"Routed query to {labels['model']} ({route})")
+    log_token_usage(response)
+    return response
+
+
+# search the user's collection with an already embedded query
+def search_by_vector(user_email: str, vector: List[float], k: int = RETRIEVAL_K) -> List[Tuple[Document, float]]:
+    if vector_db == "ASTRADB":
+        return astradb.similarity_search_with_score_by_vector(md5_b64(user_email), vector, k=k)
+    if matryoshka.is_matryoshka_collection(user_email):
+        return matryoshka.similarity_search_with_score_by_vector(vector, user_email, k=k)
+
+    vector_store = get_vector_store(user_email)
+    points = qdrant_client.query_points(
+        collection_name=vector_store.collection_name,
+        query=vector,
+        using=vector_store.vector_name,
+        limit=k,
+        search_params=models.SearchParams(hnsw_ef=RETRIEVAL_HNSW_EF),
+        with_payload=True,
+    ).points
+    return [
+        (
+            QdrantVectorStore._document_from_point(
+                point,
+                vector_store.collection_name,
+                vector_store.content_payload_key,
+                vector_store.metadata_payload_key,
+            ),
+            point.score,
+        )
+        for point in points
+    ]
+
+
+# retrieve the relevant documents & the top similarity score for the query
+def retrieve_documents(query: str, user_email: str) -> Tuple[List[Document], Optional[float]]:
+    # these calls are idempotent, so they are hedged when slower than usual
+    if not guarded_call("vectordb", collection_exists, user_email, hedge=True, priority=INTERACTIVE):
+        return [], None
+
+    # embed the query & search separately, each upstream has its own slots
+    vector = guarded_call("embeddings", embeddings.embed_query, query, hedge=True, priority=INTERACTIVE)
+
+    # Get documents with their similarity scores
+    results = guarded_call(
+        "vectordb", search_by_vector, user_email, vector, k=RETRIEVAL_K, hedge=True, priority=INTERACTIVE
+    )
+
+    top_score = max((score for _, score in results), default=None)
+    return [doc for doc, score in results if score >= SIMILARITY_THRESHOLD], top_score
 
 
 # Retrieve the answer from LLM based on the query
 # and the documents retrieved from Qdrant
-# TODO: we can use memoization here (mem0) to cache the results using the user's email as the key
-def retrieve_answer(query: str, user_email: str) -> str:
-    system_prompt = """
-    You are a helpful AI assistant that can answer user's questions based on the documents provided.
-    If there aren't any related documents, or if the user's query is not related to the documents, then you can provide the answer based on your knowledge.        Think carefully before answering the user's question.
-
-    For example:
-    User: What is the capital of France? You answer this because the user's query is not related to the documents.
-    You: The capital of France is Paris.
-
-    User: How to invest in stocks? You answer this because the user's query is related to the documents.
-    You: You can invest in stocks by opening a demat account with a stockbroker. 
-    """
-    # get the vector embeddings assocoated with that query
+# with a session id, the conversation history goes with the query & follow-up
+# questions are rewritten into standalone queries for the retrieval
+def retrieve_answer(query: str, user_email: str, session_id: Optional[str] = None) -> str:
+    start = time.perf_counter()
     try:
-        if collection_exists(user_email):
-            vector_store = get_vector_store(user_email)
+        with request_budget(REQUEST_BUDGET_SECONDS):
+            query_class = classify_query(query)
+            docs, top_score, history = [], None, []
+
+            if session_id:
+                try:
+                    history, _ = load_history(user_email, session_id)
+                except Exception as e:
+                    error_logger.error(f"Failed to load the conversation, answering without it: {e}")
+                    metrics.increment("degraded_answers", reason="history")
 
-            # Get documents with their similarity scores
-            docs = vector_store.similarity_search_with_score(
-                query, k=5
-            )
+            # chitchat doesn't need the documents, skip the retrieval
+            if query_class != "chitchat":
+                try:
+                    docs, top_score = retrieve_documents(rewrite_query(query, history), user_email)
+                except AdmissionRejectedError:
+                    raise
+                except Exception as e:
+                    # answer without the documents rather than failing the request
+                    error_logger.error(f"Retrieval failed, answering without context: {e}")
+                    metrics.increment("degraded_answers", reason="retrieval")
 
-            for doc, score in docs:
-                if score >= SIMILARITY_THRESHOLD:
-                    system_prompt += f"""
-                    Document: {doc.page_content}
-                    """
+            # the instructions are a fixed prefix, the history & documents go with the question
+            messages, context_tokens = build_messages(query, docs, history)
 
-        messages = [("system", system_prompt), ("user", query)]
+            route, tier = route_query(query_class, top_score, context_tokens)
+            try:
+                response = invoke_llm(messages, route, tier)
+            except AdmissionRejectedError:
+                raise
+            except Exception as e:
+                if tier == "small":
+                    raise
+                # fall back to the small tier when the routed model timed out or failed
+                error_logger.error(f"LLM call failed, falling back to the small tier: {e}")
+                metrics.increment("degraded_answers", reason="llm")
+                response = invoke_llm(messages, f"{route}_fallback", "small")
 
-        response = llm.invoke(messages)
-        return response.content
+            if session_id:
+                try:
+                    add_turn(user_email, session_id, query, response.content)
+                except Exception as e:
+                    error_logger.error(f"Failed to store the conversation turn: {e}")
+            return response.content
+    except AdmissionRejectedError:
+        raise
     except Exception as e:
         return f"An error occurred: {e}"
+    finally:
+        metrics.observe("ask_latency_seconds", time.perf_counter() - start)
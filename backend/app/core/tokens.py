@@ -0,0 +1,21 @@
+# Token counting helpers, the tokenizers are loaded lazily and cached per model
+from functools import lru_cache
+
+import tiktoken
+
+# encoding used for models unknown to tiktoken (gpt-4.1 & newer use o200k_base)
+DEFAULT_ENCODING = "o200k_base"
+
+
+# get the tokenizer used by the given model
+@lru_cache(maxsize=None)
+def get_encoding(model: str) -> tiktoken.Encoding:
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+
+
+# count the number of tokens in the text for the given model
+def count_tokens(text: str, model: str) -> int:
+    return len(get_encoding(model).encode_ordinary(text))
@@ -0,0 +1,315 @@
+# Bulk export & import of a user's collection, so that switching VECTOR_DB or
+# restoring a user doesn't require re-ingesting (and re-embedding) the documents
+# an export is a directory with:
+# - vectors.npy: the full embeddings as one contiguous float32 array (memory-mappable)
+# - chunks.parquet: id, content & json metadata of every chunk, in the same order
+# - documents.json: the document manifests & versions used by incremental re-ingestion
+# - export.json: source vector db, collection & dimensions
+# usage (from the backend directory):
+#   python -m app.core.transfer export --user-email me@example.com --path ./export
+#   python -m app.core.transfer import --user-email me@example.com --path ./export
+import argparse
+import json
+import os
+import shutil
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
+from typing import Any, Dict, Iterator, List, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from app.core import astradb, matryoshka
+from app.core.config import (
+    EMBEDDING_MODEL,
+    FULL_VECTOR_NAME,
+    MATRYOSHKA_VECTOR_NAME,
+    TRANSFER_BATCH_SIZE,
+    TRANSFER_WORKERS,
+)
+from app.core.constants import (
+    astradb_keyspace,
+    collection_exists,
+    create_collection_if_not_exists,
+    info_logger,
+    md5_b64,
+    qdrant_client,
+    redis_client,
+    vector_db,
+)
+from app.core.ingestion import manifest_key, versions_key
+from langchain_core.documents import Document
+from qdrant_client import models
+
+VECTORS_FILE = "vectors.npy"
+CHUNKS_FILE = "chunks.parquet"
+DOCUMENTS_FILE = "documents.json"
+EXPORT_FILE = "export.json"
+
+CHUNKS_SCHEMA = pa.schema(
+    [("id", pa.string()), ("content", pa.string()), ("metadata", pa.string())]
+)
+
+# fields of the documents written by AstraDBVectorStore & the astradb fast path
+ASTRA_CONTENT_FIELD = astradb.CONTENT_FIELD
+ASTRA_METADATA_FIELD = astradb.METADATA_FIELD
+ASTRA_VECTOR_FIELD = astradb.VECTOR_FIELD
+
+# payload keys of the points written by QdrantVectorStore
+QDRANT_CONTENT_KEY = "page_content"
+QDRANT_METADATA_KEY = "metadata"
+
+# Chunk: (id, content, metadata, vector)
+Chunk = Tuple[str, str, Dict[str, Any], List[float]]
+
+
+# full vector of a qdrant point, matryoshka collections keep it under its own name
+def _full_vector(vector) -> List[float]:
+    if isinstance(vector, dict):
+        return vector[FULL_VECTOR_NAME] if FULL_VECTOR_NAME in vector else vector[""]
+    return vector
+
+
+# stream all the chunks of a qdrant collection
+def _scroll_qdrant(collection_name: str, batch_size: int) -> Iterator[List[Chunk]]:
+    offset = None
+    while True:
+        points, offset = qdrant_client.scroll(
+            collection_name=collection_name,
+            limit=batch_size,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True,
+        )
+        yield [
+            (
+                str(point.id),
+                point.payload.get(QDRANT_CONTENT_KEY, ""),
+                point.payload.get(QDRANT_METADATA_KEY) or {},
+                _full_vector(point.vector),
+            )
+            for point in points
+        ]
+        if offset is None:
+            return
+
+
+# stream all the chunks of an astradb collection
+def _scroll_astradb(collection_name: str, batch_size: int) -> Iterator[List[Chunk]]:
+    cursor = astradb_keyspace.get_collection(collection_name).find(
+        {},
+        projection={ASTRA_CONTENT_FIELD: True, ASTRA_METADATA_FIELD: True, ASTRA_VECTOR_FIELD: True},
+    )
+    batch = []
+    for document in cursor:
+        batch.append(
+            (
+                str(document["_id"]),
+                document.get(ASTRA_CONTENT_FIELD, ""),
+                document.get(ASTRA_METADATA_FIELD) or {},
+                document[ASTRA_VECTOR_FIELD],
+            )
+        )
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# export the user's collection to the directory
+def export_collection(user_email: str, path: str, batch_size: int = TRANSFER_BATCH_SIZE) -> Dict[str, Any]:
+    collection_name = md5_b64(user_email)
+    if not collection_exists(user_email):
+        raise ValueError(f"No collection for user {user_email}")
+
+    os.makedirs(path, exist_ok=True)
+    raw_vectors_path = os.path.join(path, VECTORS_FILE + ".tmp")
+    scroll = _scroll_astradb if vector_db == "ASTRADB" else _scroll_qdrant
+
+    # the count isn't known upfront, so stream the raw vectors & add the npy header after
+    rows, dimensions = 0, None
+    with open(raw_vectors_path, "wb") as raw, pq.ParquetWriter(
+        os.path.join(path, CHUNKS_FILE), CHUNKS_SCHEMA
+    ) as writer:
+        for batch in scroll(collection_name, batch_size):
+            if not batch:
+                continue
+            vectors = np.asarray([chunk[3] for chunk in batch], dtype=np.float32)
+            dimensions = vectors.shape[1]
+            raw.write(vectors.tobytes())
+            writer.write_table(
+                pa.table(
+                    {
+                        "id": [chunk[0] for chunk in batch],
+                        "content": [chunk[1] for chunk in batch],
+                        "metadata": [json.dumps(chunk[2]) for chunk in batch],
+                    },
+                    schema=CHUNKS_SCHEMA,
+                )
+            )
+            rows += len(batch)
+
+    with open(os.path.join(path, VECTORS_FILE), "wb") as f, open(raw_vectors_path, "rb") as raw:
+        np.lib.format.write_array_header_1_0(
+            f,
+            {
+                "descr": np.lib.format.dtype_to_descr(np.dtype(np.float32)),
+                "fortran_order": False,
+                "shape": (rows, dimensions or 0),
+            },
+        )
+        shutil.copyfileobj(raw, f, length=16 * 1024 * 1024)
+    os.unlink(raw_vectors_path)
+
+    # the manifests of incremental re-ingestion, so re-uploads keep diffing after a restore
+    manifest_prefix = manifest_key(collection_name, "")
+    documents = {
+        "versions": {
+            key.decode("utf-8"): int(value)
+            for key, value in redis_client.hgetall(versions_key(collection_name)).items()
+        },
+        "manifests": {
+            key.decode("utf-8")[len(manifest_prefix):]: {
+                k.decode("utf-8"): v.decode("utf-8") for k, v in redis_client.hgetall(key).items()
+            }
+            for key in redis_client.scan_iter(match=f"{manifest_prefix}*", count=1000)
+        },
+    }
+    with open(os.path.join(path, DOCUMENTS_FILE), "w") as f:
+        json.dump(documents, f)
+
+    export = {
+        "vector_db": vector_db,
+        "collection_name": collection_name,
+        "embedding_model": EMBEDDING_MODEL,
+        "dimensions": dimensions,
+        "count": rows,
+    }
+    with open(os.path.join(path, EXPORT_FILE), "w") as f:
+        json.dump(export, f)
+    return export
+
+
+# upsert a batch of chunks into a qdrant collection
+def _upsert_qdrant(collection_name: str, use_matryoshka: bool, ids, contents, metadatas, vectors) -> None:
+    if use_matryoshka:
+        truncated = matryoshka.truncate_embeddings(vectors)
+        point_vectors = [
+            {MATRYOSHKA_VECTOR_NAME: small.tolist(), FULL_VECTOR_NAME: full.tolist()}
+            for small, full in zip(truncated, vectors)
+        ]
+    else:
+        point_vectors = [vector.tolist() for vector in vectors]
+
+    qdrant_client.upsert(
+        collection_name=collection_name,
+        points=[
+            models.PointStruct(
+                id=point_id,
+                vector=vector,
+                payload={QDRANT_CONTENT_KEY: content, QDRANT_METADATA_KEY: metadata},
+            )
+            for point_id, content, metadata, vector in zip(ids, contents, metadatas, point_vectors)
+        ],
+    )
+
+
+# insert a batch of chunks into an astradb collection, the fast path splits it into concurrent requests
+def _insert_astradb(collection_name: str, ids, contents, metadatas, vectors) -> None:
+    astradb.add_documents(
+        collection_name,
+        [Document(page_content=content, metadata=metadata) for content, metadata in zip(contents, metadatas)],
+        vectors.tolist(),
+        ids,
+    )
+
+
+# import an export directory into the user's collection of the configured vector db
+def import_collection(
+    user_email: str,
+    path: str,
+    batch_size: int = TRANSFER_BATCH_SIZE,
+    workers: int = TRANSFER_WORKERS,
+) -> Dict[str, Any]:
+    collection_name = md5_b64(user_email)
+    with open(os.path.join(path, EXPORT_FILE)) as f:
+        export = json.load(f)
+    if export["embedding_model"] != EMBEDDING_MODEL:
+        raise ValueError(
+            f"Export was embedded with {export['embedding_model']}, expected {EMBEDDING_MODEL}"
+        )
+
+    vectors = np.load(os.path.join(path, VECTORS_FILE), mmap_mode="r")
+
+    create_collection_if_not_exists(user_email)
+    if vector_db == "ASTRADB":
+        # the astradb fast path is safe to call from several threads, batches overlap like on qdrant
+        write_batch = partial(_insert_astradb, collection_name)
+    else:
+        use_matryoshka = matryoshka.is_matryoshka_collection(user_email)
+        write_batch = partial(_upsert_qdrant, collection_name, use_matryoshka)
+
+    # keep a bounded number of batches in flight, the vectors are read lazily from the memory map
+    rows = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for table in pq.ParquetFile(os.path.join(path, CHUNKS_FILE)).iter_batches(batch_size=batch_size):
+            batch = table.to_pydict()
+            count = len(batch["id"])
+            pending.add(
+                executor.submit(
+                    write_batch,
+                    batch["id"],
+                    batch["content"],
+                    [json.loads(metadata) for metadata in batch["metadata"]],
+                    np.asarray(vectors[rows : rows + count], dtype=np.float32),
+                )
+            )
+            rows += count
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+        for future in pending:
+            future.result()
+
+    documents_path = os.path.join(path, DOCUMENTS_FILE)
+    if os.path.exists(documents_path):
+        with open(documents_path) as f:
+            documents = json.load(f)
+        pipeline = redis_client.pipeline()
+        for document_name, manifest in documents["manifests"].items():
+            if manifest:
+                pipeline.hset(manifest_key(collection_name, document_name), mapping=manifest)
+        if documents["versions"]:
+            pipeline.hset(versions_key(collection_name), mapping=documents["versions"])
+        pipeline.execute()
+
+    return {"vector_db": vector_db, "collection_name": collection_name, "count": rows}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("--user-email", required=True)
+    parser.add_argument("--path", required=True, help="export directory")
+    parser.add_argument("--batch-size", type=int, default=TRANSFER_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=TRANSFER_WORKERS)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == "export":
+        result = export_collection(args.user_email, args.path, batch_size=args.batch_size)
+    else:
+        result = import_collection(
+            args.user_email, args.path, batch_size=args.batch_size, workers=args.workers
+        )
+    elapsed = time.perf_counter() - start
+    info_logger.info(f"{args.command} finished in {elapsed:.1f}s: {result}")
+    print(json.dumps({**result, "seconds": round(elapsed, 2)}))
+
+
+if __name__ == "__main__":
+    main()
@@ -105,3 +105,14 @@ def check_rate_limit(
     # Increment counter
     redis_client.incr(redis_key)
     return True
+
+
+def refund_rate_limit(user_email: str, endpoint: str) -> None:
+    """
+    Give back a request that was counted by check_rate_limit but not served, e.g. rejected by the admission control
+    """
+    redis_key = f"rate_limit:{endpoint}:{user_email}"
+
+    # DECR on an expired window creates the key without an expiry, drop it instead
+    if redis_client.decr(redis_key) <= 0:
+        redis_client.delete(redis_key)
@@ -0,0 +1,313 @@
+# Compare the astradb fast path (app.core.astradb) with the previous path
+# (listing the keyspace for collection_exists, AstraDBVectorStore with its
+# default settings for inserts & searches) against a local stub of the Data API
+# the stub keeps the collections in memory and adds a fixed latency per request,
+# so the numbers reflect the number & shape of the requests, not astra itself
+# usage (from the backend directory):
+#   python -m benchmarks.astradb_benchmark --chunks 2000 --collections 5000 --latency-ms 20
+import argparse
+import base64
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+import numpy as np
+from app.core.config import ASTRA_INSERT_CHUNK_SIZE, ASTRA_INSERT_CONCURRENCY
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+KEYSPACE = "default_keyspace"
+
+
+# astrapy sends vectors as base64 encoded big endian float32 by default
+def decode_vector(vector) -> np.ndarray:
+    if isinstance(vector, dict):
+        return np.frombuffer(base64.b64decode(vector["$binary"]), dtype=">f4").astype(np.float32)
+    return np.asarray(vector, dtype=np.float32)
+
+
+class StubDataAPI:
+    """In-memory subset of the Data API commands used by the app"""
+
+    def __init__(self, latency: float, collections: int):
+        self.latency = latency
+        self.lock = threading.Lock()
+        # other users' collections, so listing the keyspace costs what it does in production
+        self.collections: Dict[str, Dict[str, Any]] = {
+            f"user_{i:06d}": {} for i in range(collections)
+        }
+        self.requests = 0
+
+    def handle(self, path: List[str], command: Dict[str, Any]) -> Dict[str, Any]:
+        name, payload = next(iter(command.items()))
+        with self.lock:
+            self.requests += 1
+            if len(path) == 2:
+                return self._keyspace_command(name, payload)
+            if path[2] not in self.collections:
+                return {
+                    "errors": [
+                        {
+                            "errorCode": "COLLECTION_NOT_EXIST",
+                            "message": f"Collection does not exist, collection name: {path[2]}",
+                        }
+                    ]
+                }
+            return self._collection_command(self.collections[path[2]], name, payload)
+
+    def _keyspace_command(self, name: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        if name == "findCollections":
+            if (payload.get("options") or {}).get("explain"):
+                collections = [
+                    {"name": collection, "options": {"vector": {"dimension": 1536, "metric": "cosine"}}}
+                    for collection in self.collections
+                ]
+            else:
+                collections = list(self.collections)
+            return {"status": {"collections": collections}}
+        if name == "createCollection":
+            self.collections.setdefault(payload["name"], {})
+            return {"status": {"ok": 1}}
+        raise ValueError(f"unsupported keyspace command {name}")
+
+    def _collection_command(self, rows: Dict[str, Any], name: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        if name == "estimatedDocumentCount":
+            return {"status": {"count": len(rows)}}
+        if name == "insertMany":
+            inserted, errors = [], []
+            for document in payload["documents"]:
+                document_id = document.setdefault("_id", str(uuid.uuid4()))
+                document["$vector"] = decode_vector(document["$vector"])
+                if document_id in rows:
+                    errors.append(
+                        {
+                            "errorCode": "DOCUMENT_ALREADY_EXISTS",
+                            "message": f"Document already exists with the given _id: {document_id}",
+                        }
+                    )
+                    continue
+                rows[document_id] = document
+                inserted.append(document_id)
+            response = {"status": {"insertedIds": inserted}}
+            if errors:
+                response["errors"] = errors
+            return response
+        if name == "findOneAndReplace":
+            document_id = payload["filter"]["_id"]
+            before = rows.get(document_id)
+            replacement = payload["replacement"]
+            replacement["$vector"] = decode_vector(replacement["$vector"])
+            rows[document_id] = {**replacement, "_id": document_id}
+            status = {"matchedCount": int(before is not None), "modifiedCount": int(before is not None)}
+            if before is None:
+                status["upsertedId"] = document_id
+            return {"data": {"document": before}, "status": status}
+        if name == "deleteMany":
+            ids = (payload.get("filter") or {}).get("_id", {}).get("$in", [])
+            deleted = sum(rows.pop(document_id, None) is not None for document_id in ids)
+            return {"status": {"deletedCount": deleted}}
+        if name == "find":
+            return {"data": {"documents": self._find(rows, payload), "nextPageState": None}}
+        raise ValueError(f"unsupported collection command {name}")
+
+    @staticmethod
+    def _find(rows: Dict[str, Any], payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+        options = payload.get("options") or {}
+        query = (payload.get("sort") or {}).get("$vector")
+        documents = list(rows.values())
+        if query is None or not documents:
+            return documents[: options.get("limit", 20)]
+        matrix = np.stack([document["$vector"] for document in documents])
+        query = decode_vector(query)
+        cosine = matrix @ query / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query))
+        similarities = (cosine + 1) / 2
+        top = np.argsort(-similarities)[: options.get("limit", 20)]
+        projection = payload.get("projection") or {}
+        found = []
+        for i in top:
+            document = {
+                key: value
+                for key, value in documents[i].items()
+                if key == "_id" or not projection or projection.get(key)
+            }
+            if "$vector" in document:
+                document["$vector"] = document["$vector"].tolist()
+            if options.get("includeSimilarity"):
+                document["$similarity"] = float(similarities[i])
+            found.append(document)
+        return found
+
+
+def serve(api: StubDataAPI) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            # headers & body are separate writes, don't let nagle delay the body
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        def do_POST(self):
+            command = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            time.sleep(api.latency)
+            body = json.dumps(api.handle(self.path.strip("/").split("/"), command)).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    # the default listen backlog of 5 drops the connections of concurrent inserts
+    ThreadingHTTPServer.request_queue_size = 128
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class PrecomputedEmbeddings(Embeddings):
+    """Returns the benchmark's vectors, so both paths store & search the same data"""
+
+    def __init__(self, vectors: Dict[str, List[float]]):
+        self.vectors = vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.vectors[text] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        # the vector store embeds a sample sentence to find the dimension
+        return self.vectors.get(text) or [1.0] * 1536
+
+
+def report(name: str, seconds: List[float]) -> None:
+    print(
+        f"  {name:<28} total {sum(seconds) * 1000:9.1f}ms  "
+        f"p50 {np.percentile(seconds, 50) * 1000:8.2f}ms  p95 {np.percentile(seconds, 95) * 1000:8.2f}ms"
+    )
+
+
+def timed(fn, *args, **kwargs) -> float:
+    start = time.perf_counter()
+    fn(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--collections", type=int, default=5000, help="other collections in the keyspace")
+    parser.add_argument("--lookups", type=int, default=50, help="collection_exists calls")
+    parser.add_argument("--latency-ms", type=float, default=20, help="stub latency per request")
+    parser.add_argument("--insert-chunk-size", type=int, default=ASTRA_INSERT_CHUNK_SIZE)
+    parser.add_argument("--insert-concurrency", type=int, default=ASTRA_INSERT_CONCURRENCY)
+    args = parser.parse_args()
+
+    api = StubDataAPI(args.latency_ms / 1000, args.collections)
+    server = serve(api)
+    endpoint = f"http://127.0.0.1:{server.server_address[1]}"
+    # the astradb clients read their settings from the environment
+    os.environ.update(
+        ASTRA_DB_API_ENDPOINT=endpoint,
+        ASTRA_DB_APPLICATION_TOKEN="stub",
+        ASTRA_DB_ENVIRONMENT="other",
+        ASTRA_DB_KEYSPACE=KEYSPACE,
+    )
+    from app.core import astradb
+    from astrapy import DataAPIClient
+    from langchain_astradb import AstraDBVectorStore
+    from langchain_astradb.utils.astradb import SetupMode
+
+    astradb.ASTRA_INSERT_CHUNK_SIZE = args.insert_chunk_size
+    astradb.ASTRA_INSERT_CONCURRENCY = args.insert_concurrency
+
+    rng = np.random.default_rng(0)
+    texts = [f"chunk {i}" for i in range(args.chunks)]
+    queries = [f"query {i}" for i in range(args.queries)]
+    vectors = rng.standard_normal((args.chunks + args.queries, 1536)).astype(np.float32)
+    vectors = {text: vector.tolist() for text, vector in zip(texts + queries, vectors)}
+    documents = [Document(page_content=text, metadata={"page": i}) for i, text in enumerate(texts)]
+    ids = [str(uuid.uuid5(uuid.NAMESPACE_URL, text)) for text in texts]
+    query_vectors = [vectors[query] for query in queries]
+    print(
+        f"chunks: {args.chunks}, queries: {args.queries}, k: {args.k}, "
+        f"collections: {args.collections}, stub latency: {args.latency_ms}ms"
+    )
+
+    # previous path
+    keyspace = DataAPIClient(environment="other").get_database(
+        api_endpoint=endpoint, token="stub", keyspace=KEYSPACE
+    )
+    keyspace.create_collection("previous", definition={"vector": {"dimension": 1536, "metric": "cosine"}})
+    vector_store = AstraDBVectorStore(
+        collection_name="previous",
+        embedding=PrecomputedEmbeddings(vectors),
+        api_endpoint=endpoint,
+        token="stub",
+        namespace=KEYSPACE,
+        environment="other",
+        setup_mode=SetupMode.OFF,
+    )
+    api.requests = 0
+    print("previous path")
+    report(
+        "collection_exists",
+        [timed(lambda: "previous" in keyspace.list_collection_names()) for _ in range(args.lookups)],
+    )
+    report("insert", [timed(vector_store.add_documents, documents, ids=ids)])
+    report(
+        "search",
+        [
+            timed(vector_store.similarity_search_with_score_by_vector, vector, k=args.k)
+            for vector in query_vectors
+        ],
+    )
+    print(f"  requests: {api.requests}")
+
+    # fast path
+    astradb.create_collection("fast")
+    astradb._known_collections.clear()
+    api.requests = 0
+    print("fast path")
+    report("collection_exists", [timed(astradb.collection_exists, "fast") for _ in range(args.lookups)])
+    report(
+        "insert",
+        [timed(astradb.add_documents, "fast", documents, [vectors[text] for text in texts], ids)],
+    )
+    report(
+        "search",
+        [
+            timed(astradb.similarity_search_with_score_by_vector, "fast", vector, k=args.k)
+            for vector in query_vectors
+        ],
+    )
+    report(
+        "batch search",
+        [timed(astradb.batch_similarity_search_with_score_by_vector, "fast", query_vectors, k=args.k)],
+    )
+    print(f"  requests: {api.requests}")
+
+    # both paths must return the same results
+    previous = [
+        [doc.page_content for doc, _ in vector_store.similarity_search_with_score_by_vector(vector, k=args.k)]
+        for vector in query_vectors
+    ]
+    fast = [
+        [doc.page_content for doc, _ in results]
+        for results in astradb.batch_similarity_search_with_score_by_vector("fast", query_vectors, k=args.k)
+    ]
+    print(f"same results: {previous == fast}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# Compare the token aware chunking with the recursive character splitter
+# reports chunks per second, total embedded tokens and (optionally) the retrieval
+# hit rate for a set of labeled questions
+# usage (from the backend directory):
+#   python -m benchmarks.chunking_benchmark doc1.pdf doc2.pdf --questions questions.json
+# questions.json: [{"question": "...", "answer": "text expected in a retrieved chunk"}]
+import argparse
+import json
+import re
+import time
+
+from app.core.chunking import detect_document_type, split_documents
+from app.core.config import EMBEDDING_MODEL
+from app.core.tokens import count_tokens
+from langchain_community.document_loaders import PyPDFLoader
+from langchain_core.vectorstores import InMemoryVectorStore
+from langchain_openai import OpenAIEmbeddings
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+
+# normalize the text for the answer lookup
+def normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+# fraction of questions with the answer in one of the top k chunks
+def hit_rate(chunks, questions, k, embeddings) -> float:
+    vector_store = InMemoryVectorStore(embeddings)
+    vector_store.add_documents(chunks)
+    hits = 0
+    for question in questions:
+        docs = vector_store.similarity_search(question["question"], k=k)
+        answer = normalize(question["answer"])
+        hits += any(answer in normalize(doc.page_content) for doc in docs)
+    return hits / len(questions)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pdfs", nargs="+")
+    parser.add_argument("--questions", help="json file with labeled questions")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    docs_per_file = [PyPDFLoader(path).load() for path in args.pdfs]
+    pages = sum(len(docs) for docs in docs_per_file)
+    chars = sum(len(doc.page_content) for docs in docs_per_file for doc in docs)
+    print(f"files: {len(args.pdfs)}, pages: {pages}, characters: {chars}")
+
+    character_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+    token_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+        model_name=EMBEDDING_MODEL, chunk_size=250, chunk_overlap=50
+    )
+    splitters = {
+        "recursive (1000/200 chars, current)": lambda docs: character_splitter.split_documents(docs),
+        "recursive (250/50 tokens)": lambda docs: token_splitter.split_documents(docs),
+        "token aware (adaptive)": lambda docs: split_documents(
+            docs, document_type=detect_document_type(docs)
+        ),
+    }
+
+    questions = None
+    if args.questions:
+        with open(args.questions) as f:
+            questions = json.load(f)
+        embeddings = OpenAIEmbeddings(model=EMBEDDING_MODEL)
+
+    for name, split in splitters.items():
+        # best of n runs to keep the noise out
+        best = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            chunks = [chunk for docs in docs_per_file for chunk in split(docs)]
+            best = min(best, time.perf_counter() - start)
+
+        tokens = sum(count_tokens(chunk.page_content, EMBEDDING_MODEL) for chunk in chunks)
+        line = (
+            f"{name:38s} chunks {len(chunks):6d}  "
+            f"chunks/s {len(chunks) / best:10.0f}  "
+            f"time {best * 1000:8.1f}ms  embedded tokens {tokens:8d}"
+        )
+        if questions:
+            line += f"  hit@{args.k} {hit_rate(chunks, questions, args.k, embeddings):.3f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
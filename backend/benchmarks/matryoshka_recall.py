@@ -0,0 +1,80 @@
+# Measure the retrieval quality & latency of the matryoshka two stage search
+# against an exact search over the full vectors of the same collection
+# usage (from the backend directory):
+#   python -m benchmarks.matryoshka_recall --user-email me@example.com --queries queries.txt
+import argparse
+import sys
+import time
+
+import numpy as np
+from app.core import matryoshka
+from app.core.config import EMBEDDING_DIMENSIONS, MATRYOSHKA_DIMENSIONS
+from app.core.constants import embeddings, md5_b64, qdrant_client
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--user-email", required=True)
+    parser.add_argument("--queries", required=True, help="file with one query per line")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--candidates", type=int, nargs="+", default=[20, 50, 100])
+    parser.add_argument(
+        "--min-recall",
+        type=float,
+        default=0.95,
+        help="exit with an error if recall@k drops below this value",
+    )
+    args = parser.parse_args()
+
+    if not matryoshka.is_matryoshka_collection(args.user_email):
+        sys.exit("collection was not created with MATRYOSHKA_EMBEDDINGS=true")
+
+    with open(args.queries) as f:
+        queries = [line.strip() for line in f if line.strip()]
+    vectors = embeddings.embed_documents(queries)
+
+    # ground truth: exact search over the full vectors
+    exact_ids, exact_latencies = [], []
+    for vector in vectors:
+        start = time.perf_counter()
+        docs = matryoshka.exact_search_with_score_by_vector(vector, args.user_email, k=args.k)
+        exact_latencies.append(time.perf_counter() - start)
+        exact_ids.append({doc.metadata["_id"] for doc, _ in docs})
+
+    points = qdrant_client.count(md5_b64(args.user_email), exact=True).count
+    print(f"points: {points}, queries: {len(queries)}, k: {args.k}")
+    print(
+        f"vector RAM per point: {MATRYOSHKA_DIMENSIONS * 4} bytes indexed "
+        f"vs {EMBEDDING_DIMENSIONS * 4} bytes for full vectors"
+    )
+    print(
+        f"exact      p50 {np.percentile(exact_latencies, 50) * 1000:7.2f}ms  "
+        f"p95 {np.percentile(exact_latencies, 95) * 1000:7.2f}ms"
+    )
+
+    failed = False
+    for candidates in args.candidates:
+        recalls, latencies = [], []
+        for vector, truth in zip(vectors, exact_ids):
+            start = time.perf_counter()
+            docs = matryoshka.similarity_search_with_score_by_vector(
+                vector, args.user_email, k=args.k, candidates=candidates
+            )
+            latencies.append(time.perf_counter() - start)
+            found = {doc.metadata["_id"] for doc, _ in docs}
+            recalls.append(len(found & truth) / max(len(truth), 1))
+
+        recall = float(np.mean(recalls))
+        failed = failed or recall < args.min_recall
+        print(
+            f"candidates {candidates:4d}  recall@{args.k} {recall:.3f}  "
+            f"p50 {np.percentile(latencies, 50) * 1000:7.2f}ms  "
+            f"p95 {np.percentile(latencies, 95) * 1000:7.2f}ms"
+        )
+
+    if failed:
+        sys.exit(f"recall@{args.k} below the tolerance of {args.min_recall}")
+
+
+if __name__ == "__main__":
+    main()
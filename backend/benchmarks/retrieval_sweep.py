@@ -0,0 +1,231 @@
+# Offline evaluation of the retrieval settings (k, similarity threshold, chunk
+# size & overlap and the hnsw search parameter) on a labeled question set
+# every configuration reports recall@k, MRR, prompt tokens & p95 search latency,
+# the configurations no other one beats on all four form the Pareto frontier
+# the embeddings are cached on disk, so re-running a sweep costs no API calls
+# usage (from the backend directory):
+#   python -m benchmarks.retrieval_sweep doc1.pdf doc2.pdf --questions questions.json \
+#       --chunking auto 200/20 350/35 500/50 --k 3 5 8 --threshold 0.5 0.6 --hnsw-ef 32 128 exact
+# questions.json: [{"question": "...", "answer": "text expected in a retrieved chunk"}]
+# without --qdrant-url the sweep runs on an in-memory qdrant, which always searches
+# exactly, so pass the url of a local qdrant server to measure --hnsw-ef, the scratch
+# collections there are always hnsw indexed, however few chunks the documents have
+import argparse
+import json
+import re
+import time
+from itertools import product
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from app.core.chunking import detect_document_type, split_documents
+from app.core.config import EMBEDDING_DIMENSIONS, EMBEDDING_MODEL, LLM_MODEL
+from app.core.prompt import build_messages
+from app.core.tokens import count_tokens
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.storage import LocalFileStore
+from langchain_community.document_loaders import PyPDFLoader
+from langchain_core.documents import Document
+from langchain_openai import OpenAIEmbeddings
+from qdrant_client import QdrantClient, models
+
+COLLECTION_PREFIX = "retrieval_sweep"
+INDEX_TIMEOUT_SECONDS = 300
+
+
+# normalize the text for the answer lookup
+def normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+# "auto" uses the chunking profile of the detected document type, "300/30" fixed token sizes
+def parse_chunking(value: str) -> Optional[tuple]:
+    if value == "auto":
+        return None
+    chunk_tokens, overlap_tokens = value.split("/")
+    return int(chunk_tokens), int(overlap_tokens)
+
+
+# "exact" searches without the index, a number sets the hnsw candidate list size
+def search_params(hnsw_ef: str) -> models.SearchParams:
+    if hnsw_ef == "exact":
+        return models.SearchParams(exact=True)
+    return models.SearchParams(hnsw_ef=int(hnsw_ef))
+
+
+def split(docs_per_file: List[List[Document]], chunking: Optional[tuple]) -> List[Document]:
+    chunks = []
+    for docs in docs_per_file:
+        if chunking is None:
+            chunks += split_documents(docs, document_type=detect_document_type(docs))
+        else:
+            chunks += split_documents(docs, chunk_tokens=chunking[0], overlap_tokens=chunking[1])
+    return chunks
+
+
+# index the chunks in a scratch collection
+def index(
+    client: QdrantClient, collection_name: str, chunks: List[Document], embeddings, wait_for_index: bool
+) -> None:
+    if client.collection_exists(collection_name):
+        client.delete_collection(collection_name)
+    client.create_collection(
+        collection_name,
+        vectors_config=models.VectorParams(size=EMBEDDING_DIMENSIONS, distance=models.Distance.COSINE),
+        # small collections stay unindexed & are scanned, so --hnsw-ef would measure nothing,
+        # index every segment (0 disables indexing, 1kB is the smallest threshold) & never full scan
+        optimizers_config=models.OptimizersConfigDiff(indexing_threshold=1),
+        hnsw_config=models.HnswConfigDiff(full_scan_threshold=0),
+    )
+    vectors = embeddings.embed_documents([chunk.page_content for chunk in chunks])
+    client.upload_points(
+        collection_name,
+        points=[
+            models.PointStruct(
+                id=i,
+                vector=vector,
+                payload={"page_content": chunk.page_content, "metadata": chunk.metadata},
+            )
+            for i, (chunk, vector) in enumerate(zip(chunks, vectors))
+        ],
+        wait=True,
+    )
+
+    # wait=True only waits for the points to be stored, the index is built after them,
+    # searches timed before it is done would still scan the unindexed segments
+    deadline = time.monotonic() + INDEX_TIMEOUT_SECONDS
+    while wait_for_index:
+        info = client.get_collection(collection_name)
+        if info.status == models.CollectionStatus.GREEN and info.indexed_vectors_count >= len(chunks):
+            break
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"{collection_name} wasn't indexed within {INDEX_TIMEOUT_SECONDS}s")
+        time.sleep(0.5)
+
+
+# Pareto frontier: no other result has a better or equal recall, MRR, prompt tokens
+# & latency while being strictly better on at least one of them
+def pareto_frontier(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    def as_tuple(result):
+        return (result["recall"], result["mrr"], -result["prompt_tokens"], -result["p95_ms"])
+
+    frontier = []
+    for result in results:
+        values = as_tuple(result)
+        dominated = any(
+            all(o >= v for o, v in zip(as_tuple(other), values)) and as_tuple(other) != values
+            for other in results
+        )
+        if not dominated:
+            frontier.append(result)
+    return frontier
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pdfs", nargs="+")
+    parser.add_argument("--questions", required=True, help="json file with labeled questions")
+    parser.add_argument("--chunking", nargs="+", default=["auto"], help='"auto" or chunk/overlap tokens')
+    parser.add_argument("--k", type=int, nargs="+", default=[3, 5, 8])
+    parser.add_argument("--threshold", type=float, nargs="+", default=[0.5, 0.6, 0.7])
+    parser.add_argument("--hnsw-ef", nargs="+", default=["128"], help='ef values or "exact"')
+    parser.add_argument("--qdrant-url", help="local qdrant server, in-memory qdrant if not set")
+    parser.add_argument("--cache-dir", default=".embedding_cache")
+    parser.add_argument("--output", help="write all the results to this json file")
+    args = parser.parse_args()
+
+    with open(args.questions) as f:
+        questions = json.load(f)
+    answers = [normalize(question["answer"]) for question in questions]
+    docs_per_file = [PyPDFLoader(path).load() for path in args.pdfs]
+
+    embeddings = CacheBackedEmbeddings.from_bytes_store(
+        OpenAIEmbeddings(model=EMBEDDING_MODEL),
+        LocalFileStore(args.cache_dir),
+        namespace=EMBEDDING_MODEL,
+        query_embedding_cache=True,
+    )
+    query_vectors = [embeddings.embed_query(question["question"]) for question in questions]
+
+    if args.qdrant_url:
+        client = QdrantClient(url=args.qdrant_url)
+    else:
+        client = QdrantClient(location=":memory:")
+        print("in-memory qdrant searches exactly, --hnsw-ef has no effect")
+
+    results = []
+    for chunking_value in args.chunking:
+        chunking = parse_chunking(chunking_value)
+        chunks = split(docs_per_file, chunking)
+        collection_name = f"{COLLECTION_PREFIX}_{chunking_value.replace('/', '_')}"
+        index(client, collection_name, chunks, embeddings, wait_for_index=bool(args.qdrant_url))
+        print(f"chunking {chunking_value}: {len(chunks)} chunks")
+
+        for hnsw_ef, k in product(args.hnsw_ef, args.k):
+            # search once per (index setting, k), the threshold only filters the results
+            retrieved, latencies = [], []
+            for vector in query_vectors:
+                start = time.perf_counter()
+                points = client.query_points(
+                    collection_name,
+                    query=vector,
+                    limit=k,
+                    search_params=search_params(hnsw_ef),
+                    with_payload=True,
+                ).points
+                latencies.append(time.perf_counter() - start)
+                retrieved.append(points)
+            p95_ms = float(np.percentile(latencies, 95)) * 1000
+
+            for threshold in args.threshold:
+                hits, reciprocal_ranks, prompt_tokens = 0, [], []
+                for question, answer, points in zip(questions, answers, retrieved):
+                    docs = [
+                        Document(page_content=point.payload["page_content"], metadata=point.payload["metadata"])
+                        for point in points
+                        if point.score >= threshold
+                    ]
+                    rank = next(
+                        (i + 1 for i, doc in enumerate(docs) if answer in normalize(doc.page_content)),
+                        None,
+                    )
+                    hits += rank is not None
+                    reciprocal_ranks.append(1 / rank if rank else 0.0)
+                    messages, _ = build_messages(question["question"], docs)
+                    prompt_tokens.append(sum(count_tokens(content, LLM_MODEL) for _, content in messages))
+
+                results.append(
+                    {
+                        "chunking": chunking_value,
+                        "k": k,
+                        "threshold": threshold,
+                        "hnsw_ef": hnsw_ef,
+                        "recall": hits / len(questions),
+                        "mrr": float(np.mean(reciprocal_ranks)),
+                        "prompt_tokens": float(np.mean(prompt_tokens)),
+                        "p95_ms": p95_ms,
+                    }
+                )
+        client.delete_collection(collection_name)
+
+    frontier = pareto_frontier(results)
+    print(f"questions: {len(questions)}, configurations: {len(results)}, * = Pareto frontier")
+    print(
+        f"  {'chunking':>10} {'k':>3} {'threshold':>9} {'hnsw_ef':>7}  "
+        f"{'recall@k':>8} {'MRR':>6} {'prompt tokens':>13} {'p95 ms':>8}"
+    )
+    for result in sorted(results, key=lambda r: (-r["recall"], -r["mrr"], r["prompt_tokens"])):
+        marker = "*" if any(result is other for other in frontier) else " "
+        print(
+            f"{marker} {result['chunking']:>10} {result['k']:3d} {result['threshold']:9.2f} "
+            f"{result['hnsw_ef']:>7}  {result['recall']:8.3f} {result['mrr']:6.3f} "
+            f"{result['prompt_tokens']:13.0f} {result['p95_ms']:8.2f}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"results": results, "frontier": frontier}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import os
+import uuid
 
 import requests
 import streamlit as st
@@ -140,6 +141,9 @@ authenticator.check_authentification()
 # Initialize session state variables
 if "messages" not in st.session_state:
     st.session_state.messages = []
+# the backend keeps the conversation history per session
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
 
 # Backend API URL
 BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
@@ -150,12 +154,12 @@ def get_auth_headers():
     return {"X-API-KEY": os.getenv("BACKEND_API_KEY")}
 
 
-def query_backend(message, user_email):
+def query_backend(message, user_email, session_id):
     """Send a query to the backend and get the response."""
     try:
         response = requests.post(
             f"{BACKEND_URL}/ask",
-            json={"query": message, "user_email": user_email},
+            json={"query": message, "user_email": user_email, "session_id": session_id},
             headers=get_auth_headers(),
         )
         response.raise_for_status()
@@ -247,6 +251,7 @@ else:
     with col2:
         if st.button("Clear Chat", use_container_width=True, type="secondary"):
             st.session_state.messages = []
+            st.session_state.session_id = uuid.uuid4().hex
             st.rerun()
 
     # Description
@@ -275,7 +280,7 @@ else:
         # Get AI response
         with st.chat_message("assistant"):
             with st.spinner("Thinking..."):
-                response = query_backend(prompt, user_email)
+                response = query_backend(prompt, user_email, st.session_state.session_id)
                 if response:
                     st.markdown(response)
                     st.session_state.messages.append(
@@ -339,4 +344,5 @@ else:
         # Logout button
         if st.button("Logout", use_container_width=True, type="primary"):
             st.session_state.messages = []
+            st.session_state.session_id = uuid.uuid4().hex
             authenticator.logout()